@@ -0,0 +1,539 @@
+"""
+Benchmarks for the hot paths of the WarnSystem API.
+
+The API is driven against an in-memory stand-in of Red's Config and fake Discord objects, so
+no bot or network is needed, only the dependencies of the cog (Red and discord.py).
+
+Run from the root of the repository:
+
+.. code-block:: none
+
+    python3 -m benchmarks.warnsystem_bench --guilds 5 --members 2000 --cases 20000
+
+For each benchmark, the number of operations per second and the latencies at the 50th, 95th
+and 99th percentiles are printed.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from copy import deepcopy
+from datetime import datetime, timedelta
+
+from warnsystem import api as warnsystem_api
+from warnsystem.api import API
+from warnsystem.warnsystem import WarnSystem
+
+# fake IDs are made from these bases so they don't collide
+GUILD_ID = 100000000000000000
+MEMBER_ID = 200000000000000000
+CHANNEL_ID = 300000000000000000
+ROLE_ID = 400000000000000000
+
+
+# in-memory Config
+
+
+class MemoryValue:
+    """A value of the config, can be awaited, used as a context manager or set."""
+
+    def __init__(self, config: "MemoryConfig", path: tuple, default):
+        self.config = config
+        self.path = path
+        self.default = default
+
+    def __call__(self):
+        return _ValueContext(self)
+
+    async def _get(self):
+        value = self.config._get(self.path)
+        return deepcopy(self.default if value is _MISSING else value)
+
+    async def set(self, value):
+        self.config._set(self.path, deepcopy(value))
+
+
+class _ValueContext:
+    def __init__(self, value: MemoryValue):
+        self.value = value
+        self.raw = None
+
+    def __await__(self):
+        return self.value._get().__await__()
+
+    async def __aenter__(self):
+        self.raw = await self.value._get()
+        return self.raw
+
+    async def __aexit__(self, *args):
+        await self.value.set(self.raw)
+
+
+class MemoryGroup(MemoryValue):
+    """
+    A group of the config. ``depth`` is the number of identifiers missing before reaching
+    the registered defaults.
+    """
+
+    def __init__(self, config: "MemoryConfig", path: tuple, defaults: dict, depth: int = 0):
+        super().__init__(config, path, defaults)
+        self.depth = depth
+
+    def __getattr__(self, name: str):
+        if name.startswith("_") or self.depth or name not in self.default:
+            raise AttributeError(name)
+        default = self.default[name]
+        if isinstance(default, dict):
+            return MemoryGroup(self.config, self.path + (name,), default)
+        return MemoryValue(self.config, self.path + (name,), default)
+
+    async def _get(self):
+        return await self.all()
+
+    async def all(self) -> dict:
+        value = self.config._get(self.path)
+        return _merge(self.default, {} if value is _MISSING else value)
+
+    async def set_raw(self, *path, value):
+        if self.config._get(self.path) is _MISSING:
+            self.config._set(self.path, {})
+        self.config._set(self.path + path, deepcopy(value))
+
+    async def clear_raw(self, *path):
+        data = self.config._get(self.path + path[:-1])
+        if data is not _MISSING:
+            data.pop(path[-1], None)
+
+
+class MemoryConfig:
+    """
+    A stand-in of :class:`redbot.core.Config` keeping everything in a dict, with the few
+    methods used by the API.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.defaults = {
+            "GLOBAL": WarnSystem.default_global,
+            "GUILD": WarnSystem.default_guild,
+            "MODLOGS": WarnSystem.default_custom_member,
+        }
+        self.depths = {"GLOBAL": 0, "GUILD": 1, "MODLOGS": 2}
+
+    def _get(self, path: tuple):
+        value = self.data
+        for key in path:
+            try:
+                value = value[key]
+            except KeyError:
+                return _MISSING
+        return value
+
+    def _set(self, path: tuple, value):
+        data = self.data
+        for key in path[:-1]:
+            data = data.setdefault(key, {})
+        data[path[-1]] = value
+
+    def _group(self, category: str, *identifiers):
+        depth = self.depths[category] - len(identifiers)
+        path = (category,) + tuple(str(x) for x in identifiers)
+        return MemoryGroup(self, path, self.defaults[category], depth)
+
+    def __getattr__(self, name: str):
+        return getattr(self._group("GLOBAL"), name)
+
+    def guild(self, guild):
+        return self._group("GUILD", guild.id)
+
+    def custom(self, category: str, *identifiers):
+        return self._group(category, *identifiers)
+
+    async def all_guilds(self) -> dict:
+        guilds = self._get(("GUILD",))
+        if guilds is _MISSING:
+            return {}
+        return {int(x): _merge(self.defaults["GUILD"], y) for x, y in guilds.items()}
+
+
+class _Missing:
+    pass
+
+
+_MISSING = _Missing()
+
+
+def _merge(defaults: dict, value: dict) -> dict:
+    """
+    Same as Red's ``Group.nested_update``: the value is merged into a copy of the defaults.
+
+    Like with Red, the defaults are mixed at the top of the result even if some identifiers
+    are missing, so ``custom("MODLOGS", guild_id).all()`` also gives the keys of a member.
+    """
+    merged = deepcopy(defaults)
+    for key, item in value.items():
+        if isinstance(item, dict):
+            default = merged.get(key)
+            merged[key] = _merge(default if isinstance(default, dict) else {}, item)
+        else:
+            merged[key] = deepcopy(item)
+    return merged
+
+
+# fake Discord objects
+
+
+class FakePermissions:
+    def __getattr__(self, name):
+        return True
+
+
+class FakeRole:
+    def __init__(self, id: int, name: str, position: int):
+        self.id = id
+        self.name = name
+        self.position = position
+
+    def __lt__(self, other):
+        return self.position < other.position
+
+    def __ge__(self, other):
+        return self.position >= other.position
+
+
+class FakeInvite:
+    max_age = 0
+    created_at = None
+
+    def __init__(self, code: str):
+        self.code = code
+
+    def __str__(self):
+        return f"https://discord.gg/{self.code}"
+
+
+class FakeChannel:
+    def __init__(self, guild: "FakeGuild", id: int, position: int):
+        self.guild = guild
+        self.id = id
+        self.name = f"channel-{position}"
+        self.mention = f"<#{id}>"
+        self.position = position
+        self.members = []
+        self.sent = 0
+
+    def permissions_for(self, member):
+        return FakePermissions()
+
+    def overwrites_for(self, role):
+        return None
+
+    async def send(self, content=None, *, embed=None, embeds=None):
+        self.sent += 1
+
+    async def create_invite(self, **kwargs):
+        return FakeInvite(f"{self.id}{random.randint(0, 10 ** 6)}")
+
+
+class FakeMember:
+    def __init__(self, guild: "FakeGuild", id: int, top_role: FakeRole):
+        self.guild = guild
+        self.id = id
+        self.name = f"member{id}"
+        self.mention = f"<@{id}>"
+        self.avatar_url = ""
+        self.top_role = top_role
+        self.roles = [top_role]
+        self.guild_permissions = FakePermissions()
+
+    def __str__(self):
+        return f"{self.name}#0001"
+
+    async def send(self, content=None, *, embed=None):
+        pass
+
+    async def add_roles(self, *roles, reason=None):
+        self.roles.extend(roles)
+
+    async def remove_roles(self, *roles, reason=None):
+        self.roles = [x for x in self.roles if x not in roles]
+
+
+class FakeModerator(str):
+    """
+    The author of the warnings. This isn't a fake member because the API stores authors that
+    aren't :class:`discord.Member` objects as they are.
+    """
+
+    def __new__(cls, id: int):
+        moderator = super().__new__(cls, f"moderator#{id}")
+        moderator.id = id
+        moderator.mention = f"<@{id}>"
+        return moderator
+
+    def __getnewargs__(self):
+        return (self.id,)  # for deepcopy
+
+
+class FakeGuild:
+    def __init__(self, number: int, members: int):
+        self.id = GUILD_ID + number
+        self.name = f"guild{number}"
+        default_role = FakeRole(self.id, "@everyone", 0)
+        self.mute_role = FakeRole(ROLE_ID + number, "Muted", 1)
+        bot_role = FakeRole(ROLE_ID + 1000 + number, "Bot", 2)
+        self.roles = {x.id: x for x in (default_role, self.mute_role, bot_role)}
+        self.me = FakeMember(self, MEMBER_ID, bot_role)
+        self.owner = self.me
+        self.moderator = FakeModerator(MEMBER_ID + 1)
+        self.members = {}
+        for i in range(members):
+            member_id = MEMBER_ID + 1000 + number * members + i
+            self.members[member_id] = FakeMember(self, member_id, default_role)
+        self.text_channels = [FakeChannel(self, CHANNEL_ID + number * 10 + i, i) for i in range(5)]
+        self.channels = list(self.text_channels)
+
+    def get_role(self, role_id):
+        return self.roles.get(role_id)
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    async def kick(self, member, *, reason=None):
+        pass
+
+    async def ban(self, member, *, reason=None, delete_message_days=0):
+        pass
+
+    async def unban(self, member, *, reason=None):
+        pass
+
+
+class FakeBot:
+    def __init__(self, guilds: list):
+        self.loop = asyncio.get_event_loop()
+        self.guilds = guilds
+        self._guilds = {x.id: x for x in guilds}
+        self._channels = {y.id: y for x in guilds for y in x.channels}
+        self.user = guilds[0].me
+
+    def get_guild(self, guild_id):
+        return self._guilds.get(guild_id)
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def get_user(self, user_id):
+        for guild in self.guilds:
+            member = guild.get_member(user_id)
+            if member:
+                return member
+        return None
+
+    async def get_user_info(self, user_id):
+        return self.get_user(user_id)
+
+    async def is_owner(self, user):
+        return False
+
+
+# benchmarks
+
+
+def populate(config: MemoryConfig, guilds: list, cases: int, substitutions: int):
+    """Write the settings of the guilds and random cases in the config, without the API."""
+    start = int(time.time()) - 365 * 24 * 3600
+    words = ["spam", "scam", "link", "insults", "raid", "nsfw", "flood", "advertising", "alt"]
+    for guild in guilds:
+        settings = {
+            "mute_role": guild.mute_role.id,
+            "channels": {"main": guild.text_channels[0].id},
+            "substitutions": {
+                f"sub{i}": f"Substitution number {i}." for i in range(substitutions)
+            },
+            "last_case_id": cases,
+        }
+        config._set(("GUILD", str(guild.id)), settings)
+        members = list(guild.members)
+        modlog = config.data.setdefault("MODLOGS", {}).setdefault(str(guild.id), {})
+        for i in range(cases):
+            member = random.choice(members)
+            level = random.randint(1, 5)
+            data = modlog.setdefault(str(member), deepcopy(WarnSystem.default_custom_member))
+            data["cases"][str(i + 1)] = {
+                "id": i + 1,
+                "level": level,
+                "author": guild.me.id,
+                "reason": " ".join(random.sample(words, 3)),
+                "time": start + i * 60,
+                "duration": None,
+                "until": None,
+            }
+            data["counters"]["total"] += 1
+            data["counters"][str(level)] += 1
+
+
+def percentile(latencies: list, percent: float) -> float:
+    return latencies[min(len(latencies) - 1, int(round(percent / 100 * (len(latencies) - 1))))]
+
+
+async def measure(name: str, operations: int, function, prepare=None) -> list:
+    """Call ``function`` ``operations`` times and return the results as a table row."""
+    latencies = []
+    for i in range(operations):
+        args = prepare(i) if prepare else ()
+        if asyncio.iscoroutine(args):
+            args = await args
+        t1 = time.perf_counter()
+        await function(*args)
+        latencies.append(time.perf_counter() - t1)
+    total = sum(latencies)
+    latencies.sort()
+    return [
+        name,
+        str(operations),
+        f"{operations / total:.0f}" if total else "inf",
+        *(f"{percentile(latencies, x) * 1000:.3f}" for x in (50, 95, 99)),
+    ]
+
+
+async def run(args):
+    random.seed(args.seed)
+    warnsystem_api.MODLOG_BATCH_DELAY = 0  # don't wait between the modlog messages
+    guilds = [FakeGuild(i, args.members) for i in range(args.guilds)]
+    bot = FakeBot(guilds)
+    config = MemoryConfig()
+    populate(config, guilds, args.cases, args.substitutions)
+    api = API(bot, config)
+    for guild in guilds:
+        await api._get_case_index(guild)  # built once, like on a running bot
+
+    def random_member():
+        guild = random.choice(guilds)
+        return guild, random.choice(list(guild.members.values()))
+
+    reason = "Breaking the rules. [sub0] [sub1] [missing]"
+    rows = []
+    benchmarks = {
+        "warn": lambda: measure(
+            "warn",
+            args.operations,
+            lambda guild, member: api.warn(
+                guild, member, guild.moderator, 1, "Benchmark warning."
+            ),
+            lambda i: random_member(),
+        ),
+        "warn_temporary": lambda: measure(
+            "warn (temp mute)",
+            args.operations,
+            lambda guild, member: api.warn(
+                guild, member, guild.moderator, 2, "Benchmark mute.", timedelta(days=1)
+            ),
+            lambda i: random_member(),
+        ),
+        "get_all_cases": lambda: measure(
+            "get_all_cases (member)",
+            args.operations,
+            lambda guild, member: api.get_all_cases(guild, member),
+            lambda i: random_member(),
+        ),
+        "get_all_cases_guild": lambda: measure(
+            "get_all_cases (guild)",
+            max(1, args.operations // 100),
+            lambda guild: api.get_all_cases(guild),
+            lambda i: (random.choice(guilds),),
+        ),
+        "get_embeds": lambda: measure(
+            "get_embeds",
+            args.operations,
+            lambda guild, member: api.get_embeds(
+                guild, member, guild.moderator, 3, "Benchmark kick."
+            ),
+            lambda i: random_member(),
+        ),
+        "format_reason": lambda: measure(
+            "format_reason",
+            args.operations,
+            lambda guild: api.format_reason(guild, reason),
+            lambda i: (random.choice(guilds),),
+        ),
+        "check_endwarn": lambda: measure(
+            f"_check_endwarn ({args.expired} expired)",
+            max(1, args.operations // 100),
+            api._check_endwarn,
+            lambda i: expire_warns(api, guilds, args.expired),
+        ),
+    }
+    for name in args.only or benchmarks:
+        rows.append(await benchmarks[name]())
+        # let the modlog outboxes finish
+        while api._modlog_queues:
+            await asyncio.sleep(0)
+    print_table(["benchmark", "ops", "ops/s", "p50 (ms)", "p95 (ms)", "p99 (ms)"], rows)
+
+
+async def expire_warns(api: API, guilds: list, number: int) -> tuple:
+    """Create temporary mutes that already ended, to be removed by _check_endwarn."""
+    until = int(datetime.now().timestamp()) - 1
+    for i in range(number):
+        guild = random.choice(guilds)
+        member = random.choice(list(guild.members.values()))
+        member.roles.append(guild.mute_role)
+        case = {
+            "level": 2,
+            "author": guild.me.id,
+            "reason": "Benchmark mute.",
+            "time": until - 3600,
+            "duration": "1 hour",
+            "until": until - i,
+            "member": member.id,
+        }
+        await api._start_timer(guild, case)
+    return ()
+
+
+def print_table(headers: list, rows: list):
+    widths = [max(len(x[i]) for x in [headers] + rows) for i in range(len(headers))]
+    line = lambda row: "  ".join(
+        x.ljust(y) if i == 0 else x.rjust(y) for i, (x, y) in enumerate(zip(row, widths))
+    )
+    print(line(headers))
+    print("  ".join("-" * x for x in widths))
+    for row in rows:
+        print(line(row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the WarnSystem API.")
+    parser.add_argument("--guilds", type=int, default=3, help="number of guilds")
+    parser.add_argument("--members", type=int, default=1000, help="members per guild")
+    parser.add_argument("--cases", type=int, default=10000, help="existing cases per guild")
+    parser.add_argument("--substitutions", type=int, default=20, help="substitutions per guild")
+    parser.add_argument("--operations", type=int, default=1000, help="calls per benchmark")
+    parser.add_argument(
+        "--expired", type=int, default=100, help="temporary warns ended per _check_endwarn call"
+    )
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=[
+            "warn",
+            "warn_temporary",
+            "get_all_cases",
+            "get_all_cases_guild",
+            "get_embeds",
+            "format_reason",
+            "check_endwarn",
+        ],
+        help="benchmarks to run, all by default",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random data")
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Tests of the data stored by WarnSystem, run against the in-memory Config of the benchmarks.
+
+Like Red, this Config mixes the registered defaults in the dict returned by ``.all()`` when
+some identifiers are missing, so ``custom("MODLOGS").all()`` has the keys of a member next to
+the guild IDs.
+
+Run from the root of the repository with ``python3 -m pytest tests``.
+"""
+
+import asyncio
+
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("redbot")
+
+from benchmarks.warnsystem_bench import FakeBot, FakeGuild, MemoryConfig  # noqa: E402
+from warnsystem import api as warnsystem_api  # noqa: E402
+from warnsystem.api import API  # noqa: E402
+
+LEGACY_FORMAT = "%a %d %B %Y %H:%M:%S"
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def make_api(modlogs: dict, data_version: int = 0):
+    guild = FakeGuild(0, 2)
+    config = MemoryConfig()
+    config.data["GLOBAL"] = {"data_version": data_version}
+    config.data["MODLOGS"] = {str(guild.id): modlogs}
+    return API(FakeBot([guild]), config), config, guild
+
+
+def legacy_case(time: datetime, level: int = 1) -> dict:
+    return {
+        "level": level,
+        "author": 1,
+        "reason": "spam",
+        "time": time.strftime(LEGACY_FORMAT),
+        "duration": None,
+        "until": None,
+    }
+
+
+def test_defaults_are_mixed_like_red():
+    api, config, guild = make_api({})
+    modlogs = run(config.custom("MODLOGS").all())
+    assert "counters" in modlogs and "cases" in modlogs
+
+
+def test_migrate_timestamps():
+    date = datetime(2018, 5, 1, 12, 30, 15)
+    member = str(next(iter(FakeGuild(0, 2).members)))
+    api, config, guild = make_api({member: {"x": [legacy_case(date)]}})
+    run(api._migrate_timestamps())
+    modlogs = config.data["MODLOGS"]
+    # the defaults mixed in by .all() are not written back
+    assert list(modlogs) == [str(guild.id)]
+    assert list(modlogs[str(guild.id)]) == [member]
+    assert modlogs[str(guild.id)][member]["x"][0]["time"] == int(date.timestamp())
+
+
+def test_migrate_counters():
+    member = str(next(iter(FakeGuild(0, 2).members)))
+    cases = [legacy_case(datetime(2018, 5, 1), level) for level in (1, 3, 3)]
+    for case in cases:
+        case["time"] = 0
+    api, config, guild = make_api({member: {"x": cases}})
+    run(api._migrate_counters())
+    modlogs = config.data["MODLOGS"]
+    assert list(modlogs[str(guild.id)]) == [member]
+    counters = modlogs[str(guild.id)][member]["counters"]
+    assert counters == {"total": 3, "1": 1, "2": 0, "3": 2, "4": 0, "5": 0}
+
+
+def only_ids(data: dict) -> bool:
+    return all(x.isdigit() for x in data)
+
+
+def check_modlogs(config: MemoryConfig):
+    """The defaults mixed in by .all() must never be written as guilds or members."""
+    modlogs = config.data["MODLOGS"]
+    assert only_ids(modlogs)
+    assert all(only_ids(x) for x in modlogs.values())
+
+
+def warn_and_query(api: API, guild: FakeGuild, config: MemoryConfig, monkeypatch):
+    monkeypatch.setattr(warnsystem_api, "MODLOG_BATCH_DELAY", 0)
+    config._set(("GUILD", str(guild.id), "channels"), {"main": guild.text_channels[0].id})
+    api._invalidate_settings(guild)
+    member = list(guild.members.values())[1]
+    run(api.warn(guild, member, guild.moderator, 1, "New warning."))
+    cases = run(api.get_all_cases(guild, member))
+    assert cases[-1]["reason"] == "New warning."
+    page, cursor = run(api.query_cases(guild, member=member))
+    assert [x["id"] for x in page] == [x["id"] for x in cases]
+    assert cursor is None
+    check_modlogs(config)
+    return cases
+
+
+def test_update_data_legacy(monkeypatch):
+    date = datetime(2018, 5, 1, 12, 30, 15)
+    member = str(next(iter(FakeGuild(0, 2).members)))
+    api, config, guild = make_api({member: {"x": [legacy_case(date), legacy_case(date, 3)]}})
+    run(api._update_data())
+    assert config.data["GLOBAL"]["data_version"] == 3
+    check_modlogs(config)
+    cases = config.data["MODLOGS"][str(guild.id)][member]["cases"]
+    assert sorted(cases) == ["1", "2"]
+    assert cases["1"]["time"] == int(date.timestamp())
+    cases = warn_and_query(api, guild, config, monkeypatch)
+    assert cases[-1]["id"] == 3
+
+
+def test_update_data_empty(monkeypatch):
+    api, config, guild = make_api({})
+    run(api._update_data())
+    assert config.data["GLOBAL"]["data_version"] == 3
+    check_modlogs(config)
+    cases = warn_and_query(api, guild, config, monkeypatch)
+    assert [x["id"] for x in cases] == [1]
+
+
+def test_archive_cases(tmp_path):
+    guild = FakeGuild(0, 2)
+    config = MemoryConfig()
+    api = API(FakeBot([guild]), config, tmp_path)
+    run(api._update_data())
+    old = datetime.now() - timedelta(days=40)
+    first, second = guild.members.values()
+    run(api._create_case(guild, first, guild.moderator, 1, old, "archived"))
+    # a running temporary warn stops the archival of the member's next cases
+    run(api._create_case(guild, first, guild.moderator, 2, old, "running", timedelta(days=100)))
+    run(api._create_case(guild, first, guild.moderator, 1, old, "kept"))
+    run(api._create_case(guild, second, guild.moderator, 1, old, "archived"))
+    run(api._create_case(guild, second, guild.moderator, 1, datetime.now(), "recent"))
+    positions = [x["reason"] for x in run(api.get_all_cases(guild, first))]
+    assert run(api._archive_cases(guild, 30)) == 2
+    check_modlogs(config)
+    modlogs = config.data["MODLOGS"][str(guild.id)]
+    assert sorted(modlogs[str(first.id)]["cases"]) == ["2", "3"]
+    assert modlogs[str(first.id)]["archived"] == 1
+    assert sorted(modlogs[str(second.id)]["cases"]) == ["5"]
+    assert [x["reason"] for x in run(api.get_all_cases(guild, first))] == positions
+    assert run(api.get_case(guild, first, 1))["reason"] == "archived"
+
+
+def test_load_timers_keeps_the_heap():
+    api, config, guild = make_api({})
+    config._set(
+        ("GUILD", str(guild.id), "temporary_warns"),
+        [{"member": 1, "until": 100}, {"member": 2, "until": 200}],
+    )
+    api._retry_timer(100, guild.id, 1)  # failed once, waiting for its backoff
+    api._push_timer(300, guild.id, 3)  # started while the config was read
+    run(api._load_timers())
+    assert sorted(x[1:] for x in api._timers) == [
+        (guild.id, 1, 100),
+        (guild.id, 2, 200),
+        (guild.id, 3, 300),
+    ]
+    assert next(x[0] for x in api._timers if x[2] == 1) > 100
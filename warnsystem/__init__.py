@@ -86,10 +86,13 @@ async def setup(bot):
     sentry.enable_stdout()
     n._set_log(sentry)
     create_cache(cog_data_path(n))
+    await n.api._update_data()
     if await n.data.enable_sentry() is None:
         response = await ask_enable_sentry(bot)
         await n.data.enable_sentry.set(response)
     if await n.data.enable_sentry():
         n.sentry.enable()
+    # only started now, the loops must not read the config before it is updated
+    n._start_tasks()
     bot.add_cog(n)
     log.debug("Cog successfully loaded on the instance.")
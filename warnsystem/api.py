@@ -1,12 +1,20 @@
 import asyncio
 import discord
+import gzip
+import heapq
+import inspect
+import json
 import logging
 import os
+import re
 import sys
 
+from bisect import bisect_left
 from copy import deepcopy
-from typing import Union, Optional
+from itertools import chain, repeat
+from typing import Union, Optional, Callable
 from datetime import datetime, timedelta
+from pathlib import Path
 
 try:
     from redbot.core.modlog import get_modlog_channel as get_red_modlog_channel
@@ -15,6 +23,8 @@ except RuntimeError:
 
 from .warnsystem import _  # translator
 from . import errors
+from .cache import CaseIndex, TTLCache
+from .stats import Stats, ConfigProxy, timed
 
 log = logging.getLogger("laggron.warnsystem")
 if logging.getLogger("red").isEnabledFor(logging.DEBUG):
@@ -23,6 +33,53 @@ if logging.getLogger("red").isEnabledFor(logging.DEBUG):
 else:
     log.setLevel(logging.WARNING)
 
+# time to wait for more embeds before posting in a modlog channel
+MODLOG_BATCH_DELAY = 1
+# number of invites created in advance for each guild using the {invite} placeholder
+INVITE_POOL_SIZE = 3
+# seconds to wait before trying to create invites again after an error
+INVITE_RETRY_DELAY = 600
+# invites of the pool expiring in less than this number of seconds are not used
+INVITE_EXPIRATION_MARGIN = 3600
+# default number of channels edited at the same time when setting up the mute role,
+# the command uses the mute_concurrency setting of the guild
+MUTE_OVERWRITE_CONCURRENCY = 5
+# seconds between each check of the mute role overwrites
+MUTE_DRIFT_INTERVAL = 3600
+# the end of a temporary warn that failed is retried after TIMER_RETRY_DELAY seconds, doubled
+# after each failure up to TIMER_MAX_RETRY_DELAY seconds, the same delays are used for restarting
+# the loop after a crash
+TIMER_RETRY_DELAY = 30
+TIMER_MAX_RETRY_DELAY = 3600
+# maximum number of temporary warns ended at the same time, in total and for a single guild
+EXPIRATION_CONCURRENCY = 20
+EXPIRATION_GUILD_CONCURRENCY = 5
+# users fetched from the API are kept for USER_CACHE_TTL seconds, up to USER_CACHE_SIZE users
+USER_CACHE_SIZE = 1000
+USER_CACHE_TTL = 3600
+# seconds before trying again to fetch a user that couldn't be found
+USER_NEGATIVE_CACHE_TTL = 300
+# seconds between each dump of the statistics in the data path
+STATS_DUMP_INTERVAL = 3600
+# seconds between each run of the compactor moving the old cases to the archives
+ARCHIVE_INTERVAL = 86400
+# archives read from the disk are kept for ARCHIVE_CACHE_TTL seconds, up to ARCHIVE_CACHE_SIZE
+ARCHIVE_CACHE_SIZE = 10
+ARCHIVE_CACHE_TTL = 600
+# old versions of discord.py can only send one embed per message
+MULTIPLE_EMBEDS = "embeds" in inspect.signature(discord.abc.Messageable.send).parameters
+
+
+def _only_ids(data: dict) -> dict:
+    """
+    Keep the items of a dict read from the config whose key is a Discord ID.
+
+    When some identifiers are missing, Red mixes the defaults of the group in the dict returned
+    by ``.all()``, so ``custom("MODLOGS").all()`` also has the keys of a member next to the
+    guild IDs. They must be skipped, and never written back.
+    """
+    return {x: y for x, y in data.items() if x.isdigit()}
+
 
 class API:
     """
@@ -45,14 +102,274 @@ class API:
             version = bot.get_cog('WarnSystem').__version__
     """
 
-    def __init__(self, bot, config):
+    def __init__(self, bot, config, archive_path: Optional[Path] = None):
         self.bot = bot
-        self.data = config
+        # latency and Config operations of the API calls, see _get_stats
+        self._stats = Stats()
+        self.data = ConfigProxy(config, self._stats)
+
+        # min-heap of (due, guild_id, member_id, until) for the temporary warns
+        # filled by _load_timers when the loop starts, then kept updated by _start_timer
+        # due is the same as until, unless the end of the warn is retried after a failure
+        self._timers = []
+        self._timers_event = asyncio.Event()
+        self._timer_attempts = {}  # (guild_id, member_id, until): number of failures
+        self._timer_stats = {"completed": 0, "failed": 0, "retried": 0, "restarts": 0}
+        self._expiration_semaphore = asyncio.Semaphore(EXPIRATION_CONCURRENCY)
+
+        # snapshot of each guild's settings, loaded with a single read by _get_settings
+        # any write to the guild settings must call _invalidate_settings
+        self._settings = {}
+        self._settings_version = {}
+        # regex matching all the substitutions of a guild, see format_reason
+        self._substitution_patterns = {}  # guild ID: (substitutions, pattern)
+
+        # index of the cases of each guild, loaded by _get_case_index
+        # updated by _create_case, edit_case and delete_case
+        self._case_indexes = {}
+        self._case_indexes_lock = asyncio.Lock()
+        # held while writing the modlogs of a guild and updating its index, so the compactor,
+        # which rewrites the cases of the members it archives, can't overwrite a case
+        # modified at the same time
+        self._modlog_locks = {}  # guild ID: asyncio.Lock
+
+        # old cases moved out of the config to one gzip file per guild, see _archive_cases
+        # nothing is archived if the path is None
+        self._archive_path = archive_path
+        self._archives = TTLCache(ARCHIVE_CACHE_SIZE, ARCHIVE_CACHE_TTL)  # guild ID: CaseIndex
+        self._archives_lock = asyncio.Lock()  # held while reading or writing an archive file
+
+        # embeds waiting to be posted in each modlog channel, see _send_modlog
+        self._modlog_queues = {}
+
+        # invites created in advance for the {invite} placeholder and the reinvites,
+        # see _get_invite
+        self._invite_pools = {}
+        # channel where the invites are created, see _get_invite_channel
+        # removed by _invalidate_invite_channel on channel, role or permission changes
+        self._invite_channels = {}
+        self._invite_refills = set()  # guilds with a refill running
+        self._invite_errors = {}  # guild ID: time of the last error
+
+        # users fetched by _get_user_info, and IDs of unknown users
+        self._user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        self._user_negative_cache = TTLCache(USER_CACHE_SIZE, USER_NEGATIVE_CACHE_TTL)
+
+        # last known overwrite of each mute role in each channel, see _check_mute_overwrite
+        self._mute_overwrites = {}  # role ID: {channel ID: (allow, deny)}
 
         # importing this here prevents a RuntimeError when building the documentation
         # TODO find another solution
 
+    async def _get_settings(self, guild: discord.Guild) -> dict:
+        """
+        Get all the settings of a guild, read from the config only once.
+
+        The returned dict is shared, don't modify it.
+        """
+        try:
+            return self._settings[guild.id]
+        except KeyError:
+            pass
+        version = self._settings_version.get(guild.id, 0)
+        settings = await self.data.guild(guild).all()
+        if self._settings_version.get(guild.id, 0) == version:
+            # don't store the snapshot if the settings were modified while reading them
+            self._settings[guild.id] = settings
+        return settings
+
+    def _invalidate_settings(self, guild: discord.Guild):
+        """Remove the settings snapshot of a guild. Call this after editing its settings."""
+        self._settings.pop(guild.id, None)
+        self._settings_version[guild.id] = self._settings_version.get(guild.id, 0) + 1
+
+    async def _get_case_index(self, guild: discord.Guild) -> CaseIndex:
+        """Get the index of the cases of a guild, built from the config on the first call."""
+        try:
+            return self._case_indexes[guild.id]
+        except KeyError:
+            pass
+        async with self._case_indexes_lock:
+            if guild.id in self._case_indexes:
+                # built while we were waiting for the lock
+                return self._case_indexes[guild.id]
+            index = CaseIndex()
+            logs = await self.data.custom("MODLOGS", guild.id).all()
+            for member, content in _only_ids(logs).items():
+                for case in sorted(content["cases"].values(), key=lambda x: x["id"]):
+                    index.add(int(member), case, case["time"] or 0)
+                if content.get("archived"):
+                    index.archived[int(member)] = content["archived"]
+            # the last case may have been deleted, its ID must not be given again
+            index.last_id = max(index.last_id, await self.data.guild(guild).last_case_id())
+            self._case_indexes[guild.id] = index
+            log.debug(f"Built the index of {len(index)} cases for guild {guild} (ID: {guild.id}).")
+            return index
+
+    def _invalidate_case_index(self, guild: Optional[discord.Guild] = None):
+        """Remove the index of a guild, or all of them. Call this after editing the modlogs."""
+        if guild:
+            self._case_indexes.pop(guild.id, None)
+        else:
+            self._case_indexes.clear()
+
+    def _get_modlog_lock(self, guild: discord.Guild) -> asyncio.Lock:
+        """Get the lock to hold while writing the modlogs of a guild."""
+        try:
+            return self._modlog_locks[guild.id]
+        except KeyError:
+            lock = self._modlog_locks[guild.id] = asyncio.Lock()
+            return lock
+
+    def _get_archive_file(self, guild: discord.Guild) -> Path:
+        return self._archive_path / f"{guild.id}.jsonl.gz"
+
+    def _read_archive(self, path: Path) -> CaseIndex:
+        """Build the index of an archive file. This is blocking, run it in an executor."""
+        cases = {}
+        try:
+            with gzip.open(path, "rt") as file:
+                for line in file:
+                    case = json.loads(line)
+                    # a case is written twice if it was archived again after an error
+                    cases[case["id"]] = case
+        except FileNotFoundError:
+            pass
+        index = CaseIndex()
+        for case_id in sorted(cases):
+            case = cases[case_id]
+            index.add(case.pop("member"), case, case["time"] or 0)
+        return index
+
+    def _write_archive(self, path: Path, cases: list, append: bool = True):
+        """
+        Write cases, with their ``"member"`` key, to an archive file. This is blocking, run it
+        in an executor.
+
+        When appending, a new gzip member is added at the end of the file, so the existing
+        cases are not decompressed. Otherwise, the file is replaced.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if append:
+            with gzip.open(path, "at") as file:
+                file.writelines(json.dumps(x) + "\n" for x in cases)
+            return
+        temp = path.with_name(path.name + ".tmp")
+        with gzip.open(temp, "wt") as file:
+            file.writelines(json.dumps(x) + "\n" for x in cases)
+        os.replace(temp, path)
+
+    async def _load_archive(self, guild: discord.Guild) -> CaseIndex:
+        """Same as _get_archive, but _archives_lock must be held."""
+        try:
+            return self._archives.get(guild.id, count=False)
+        except KeyError:
+            pass
+        if self._archive_path is None:
+            return CaseIndex()
+        archive = await self.bot.loop.run_in_executor(
+            None, self._read_archive, self._get_archive_file(guild)
+        )
+        index = await self._get_case_index(guild)
+        for case_id in [x for x in archive.by_id if x in index.by_id]:
+            # the compactor failed before removing these from the config
+            archive.remove(case_id)
+        self._archives.set(guild.id, archive)
+        log.debug(f"Read {len(archive)} archived cases for guild {guild} (ID: {guild.id}).")
+        return archive
+
+    async def _get_archive(self, guild: discord.Guild) -> CaseIndex:
+        """
+        Get the index of the archived cases of a guild, read from the disk if it's not cached.
+        """
+        try:
+            return self._archives.get(guild.id)
+        except KeyError:
+            pass
+        async with self._archives_lock:
+            return await self._load_archive(guild)
+
+    async def _get_indexes(
+        self, guild: discord.Guild, member: Optional[int] = None, since: Optional[float] = None
+    ) -> list:
+        """
+        Get the indexes that can hold the cases matching the filters: the archive, only read
+        if it can have some of them, then the cases of the config.
+        """
+        index = await self._get_case_index(guild)
+        horizon = (await self._get_settings(guild))["archive_horizon"]
+        if horizon is None or (since is not None and since >= horizon):
+            return [index]
+        if member is not None and not index.archived.get(member):
+            return [index]
+        return [await self._get_archive(guild), index]
+
+    async def _get_member_case(self, guild: discord.Guild, member_id: int, position: int) -> dict:
+        """
+        Get the case of a member at the given position (starting at 0), counting the archived
+        cases first.
+        """
+        index = await self._get_case_index(guild)
+        archived = index.archived.get(member_id, 0)
+        try:
+            if position < archived:
+                return (await self._get_archive(guild)).get(member_id, position)
+            return index.get(member_id, position - archived)
+        except (KeyError, IndexError):
+            raise errors.NotFound("The case requested doesn't exist.")
+
+    async def _edit_archive(
+        self, guild: discord.Guild, case_id: int, new_reason: Optional[str] = None
+    ) -> dict:
+        """
+        Edit the reason of an archived case, or delete it if no reason is given.
+
+        The whole archive file is rewritten, this should be rare.
+        """
+        if (await self._get_settings(guild))["archive_horizon"] is None:
+            raise errors.NotFound("The case requested doesn't exist.")
+        async with self._archives_lock:
+            archive = await self._load_archive(guild)
+            try:
+                if new_reason is None:
+                    case = archive.remove(case_id)
+                else:
+                    case = archive.set_reason(case_id, new_reason)
+            except KeyError:
+                raise errors.NotFound("The case requested doesn't exist.")
+            cases = [archive.cases[x] for x in archive.by_time]
+            await self.bot.loop.run_in_executor(
+                None, self._write_archive, self._get_archive_file(guild), cases, False
+            )
+        return case
+
+    async def _clear_archive(self, guild: discord.Guild):
+        """Delete the archived cases of a guild. The modlogs of the config are not modified."""
+        async with self._archives_lock:
+            try:
+                await self.bot.loop.run_in_executor(None, self._get_archive_file(guild).unlink)
+            except FileNotFoundError:
+                pass
+            self._archives.pop(guild.id)
+        await self.data.guild(guild).archive_horizon.set(None)
+        self._invalidate_settings(guild)
+
+    def _format_case(self, guild: discord.Guild, case: dict) -> dict:
+        """Make a copy of an indexed case, with the objects returned by the API."""
+        case = dict(case)
+        author = guild.get_member(case["author"])
+        case["time"] = self._from_timestamp(case["time"])
+        case["until"] = self._from_timestamp(case.get("until"))
+        case["member"] = self.bot.get_user(case["member"])
+        case["author"] = author if author else case["author"]  # can be None or a string
+        return case
+
+    def _from_timestamp(self, time: Optional[int]) -> Optional[datetime]:
+        """Convert a timestamp stored in the config to a local datetime."""
+        return datetime.fromtimestamp(time) if time is not None else None
+
     def _get_datetime(self, time: str) -> datetime:
+        """Parse a date stored as a string, before the timestamps were used."""
         try:
             time = datetime.strptime(time, "%a %d %B %Y %H:%M:%S")
         except ValueError:
@@ -104,28 +421,235 @@ class API:
             raise errors.BadArgument("No duration for this warning!")
         async with self.data.guild(guild).temporary_warns() as warns:
             warns.append(case)
+        self._invalidate_settings(guild)
+        self._push_timer(case["until"], guild.id, case["member"])
         return True
 
-    async def _get_user_info(self, user_id: int):
-        user = self.bot.get_user(user_id)
-        if not user:
+    def _push_timer(self, until: int, guild_id: int, member_id: int, due: Optional[int] = None):
+        """Schedule a timer and wake up the loop if it is now the next one to end."""
+        timer = (due or until, guild_id, member_id, until)
+        heapq.heappush(self._timers, timer)
+        if self._timers[0] == timer:
+            self._timers_event.set()
+
+    def _retry_timer(self, until: int, guild_id: int, member_id: int):
+        """Schedule a timer again after a failure, with an exponential backoff."""
+        attempts = self._timer_attempts.get((guild_id, member_id, until), 0)
+        self._timer_attempts[(guild_id, member_id, until)] = attempts + 1
+        delay = min(TIMER_RETRY_DELAY * 2 ** attempts, TIMER_MAX_RETRY_DELAY)
+        self._timer_stats["retried"] += 1
+        self._push_timer(until, guild_id, member_id, due=int(datetime.now().timestamp()) + delay)
+
+    async def _load_timers(self):
+        """Add the temporary warns saved in the config to the heap of timers."""
+        timers = []
+        for guild_id, data in (await self.data.all_guilds()).items():
+            for action in data.get("temporary_warns", []):
+                if not action["until"]:
+                    continue
+                timers.append((action["until"], guild_id, action["member"], action["until"]))
+        # merged with the heap: the timers started while reading the config, and the ones
+        # waiting for a retry with their backoff, are kept
+        scheduled = {x[1:] for x in self._timers}
+        self._timers.extend(x for x in timers if x[1:] not in scheduled)
+        heapq.heapify(self._timers)
+        log.debug(f"Loaded {len(timers)} timers for unmutes and unbans.")
+
+    def _convert_legacy_time(self, time: Optional[Union[str, int]]) -> Optional[int]:
+        """Convert a date stored as a string to a timestamp."""
+        if not isinstance(time, str):
+            return time
+        try:
+            return int(self._get_datetime(time).timestamp())
+        except ValueError:
+            # the locale probably changed since the case was created
+            log.warn(f'Couldn\'t parse the date "{time}" when converting it to a timestamp.')
+            return None
+
+    async def _migrate_timestamps(self):
+        """
+        Convert the dates of all cases and temporary warns from strings to timestamps.
+
+        The modlogs are read and written back in a single operation. The dates that can't be
+        parsed become None, and the temporary warns without an end date are removed.
+        """
+        modlogs = _only_ids(await self.data.custom("MODLOGS").all())
+        total = 0
+        for guild_id, guild in modlogs.items():
+            modlogs[guild_id] = guild = _only_ids(guild)
+            for content in guild.values():
+                for case in content.get("x", []):
+                    case["time"] = self._convert_legacy_time(case.get("time"))
+                    case["until"] = self._convert_legacy_time(case.get("until"))
+                    total += 1
+        await self.data.custom("MODLOGS").set(modlogs)
+        for guild_id, data in (await self.data.all_guilds()).items():
+            warns = data.get("temporary_warns")
+            if not warns:
+                continue
+            for action in warns:
+                action["time"] = self._convert_legacy_time(action.get("time"))
+                action["until"] = self._convert_legacy_time(action.get("until"))
+                if action["until"] is None:
+                    # would never end, and never be removed from the config
+                    log.warn(
+                        f"Removed the temporary warn of member {action['member']} on guild "
+                        f"{guild_id} because its end date couldn't be converted. The member "
+                        "must be unmuted or unbanned manually."
+                    )
+            warns = [x for x in warns if x["until"] is not None]
+            await self.data.guild(discord.Object(id=guild_id)).temporary_warns.set(warns)
+        self._settings.clear()
+        self._invalidate_case_index()
+        log.info(f"Converted the dates of {total} cases to timestamps.")
+
+    async def _migrate_counters(self):
+        """Count the existing cases of all members to initialize their warning counters."""
+        modlogs = _only_ids(await self.data.custom("MODLOGS").all())
+        for guild_id, guild in modlogs.items():
+            modlogs[guild_id] = guild = _only_ids(guild)
+            for content in guild.values():
+                content["counters"] = self._count_cases(content.get("x", []))
+        await self.data.custom("MODLOGS").set(modlogs)
+        log.info("Initialized the warning counters of all members.")
+
+    async def _migrate_case_ids(self):
+        """
+        Give an ID to all cases, and store the cases of each member in a dict keyed by ID
+        instead of a list, so a single case can be read or written.
+
+        The IDs of a guild are given from the oldest case to the newest, while keeping the
+        order of the modlog of each member.
+        """
+        modlogs = _only_ids(await self.data.custom("MODLOGS").all())
+        total = 0
+        for guild_id, guild in modlogs.items():
+            modlogs[guild_id] = guild = _only_ids(guild)
+            members = list(guild.values())
+            for content in members:
+                content["cases"] = {}
+            cases = heapq.merge(
+                *([(x, content) for x in content.pop("x", [])] for content in members),
+                key=lambda x: x[0]["time"] or 0,
+            )
+            last_id = 0
+            for case, content in cases:
+                last_id += 1
+                case["id"] = last_id
+                content["cases"][str(last_id)] = case
+            await self.data.guild(discord.Object(id=int(guild_id))).last_case_id.set(last_id)
+            total += last_id
+        await self.data.custom("MODLOGS").set(modlogs)
+        self._settings.clear()
+        self._invalidate_case_index()
+        log.info(f"Gave an ID to {total} cases.")
+
+    async def _update_data(self):
+        """Update the config to the latest format if needed. Called when loading the cog."""
+        version = await self.data.data_version()
+        if version < 1:
+            await self._migrate_timestamps()
+            version = 1
+        if version < 2:
+            await self._migrate_counters()
+            version = 2
+        if version < 3:
+            await self._migrate_case_ids()
+            version = 3
+        await self.data.data_version.set(version)
+
+    def _count_cases(self, cases: list) -> dict:
+        """Build the warning counters from a list of cases."""
+        counters = {"total": len(cases), "1": 0, "2": 0, "3": 0, "4": 0, "5": 0}
+        for case in cases:
+            counters[str(case["level"])] += 1
+        return counters
+
+    async def _get_counters(self, guild: discord.Guild, user: discord.User) -> dict:
+        """
+        Get the number of warnings of a member, with the ``"total"`` key and one key per level.
+
+        These are kept up to date with the cases, so we don't need to read the whole modlog.
+        """
+        return await self.data.custom("MODLOGS", guild.id, user.id).counters()
+
+    async def _update_counters(self, guild: discord.Guild, user_id: int, level: int, amount: int):
+        async with self.data.custom("MODLOGS", guild.id, user_id).counters() as counters:
+            counters["total"] += amount
+            counters[str(level)] += amount
+
+    def _send_modlog(self, channel: discord.TextChannel, embed: discord.Embed):
+        """
+        Add an embed to the outbox of a modlog channel, without waiting for it to be posted.
+
+        The embeds are collected for a short time, then posted together to avoid the rate limits.
+        """
+        queue = self._modlog_queues.get(channel.id)
+        if queue is None:
+            queue = self._modlog_queues[channel.id] = asyncio.Queue()
+            self.bot.loop.create_task(self._modlog_outbox(channel, queue))
+        queue.put_nowait(embed)
+
+    async def _modlog_outbox(self, channel: discord.TextChannel, queue: asyncio.Queue):
+        """Post the embeds of a modlog channel until its outbox is empty."""
+        while not queue.empty():
+            await asyncio.sleep(MODLOG_BATCH_DELAY)
+            embeds = []
+            while len(embeds) < 10 and not queue.empty():
+                embeds.append(queue.get_nowait())
             try:
-                user = await self.bot.get_user_info(user_id)
-            except discord.errors.NotFound:
-                user = None
-            except discord.errors.HTTPException as e:
-                user = None
+                if MULTIPLE_EMBEDS:
+                    await channel.send(embeds=embeds)
+                else:
+                    for embed in embeds:
+                        await channel.send(embed=embed)
+            except Exception as e:
                 log.error(
-                    "Received HTTPException when trying to get user info. "
-                    "This is probaby a cooldown from Discord.",
+                    f"Couldn't post {len(embeds)} embeds in the modlog channel {channel} "
+                    f"(ID: {channel.id}) of guild {channel.guild} (ID: {channel.guild.id}).",
                     exc_info=e,
                 )
+        del self._modlog_queues[channel.id]
+
+    async def _get_user_info(self, user_id: int):
+        """
+        Get a user, fetched from the Discord API if it's not in the bot's cache.
+
+        Fetched users are cached, as well as the IDs of unknown users for a shorter time.
+        """
+        user = self.bot.get_user(user_id)
+        if user:
+            return user
+        try:
+            return self._user_cache.get(user_id)
+        except KeyError:
+            pass
+        try:
+            self._user_negative_cache.get(user_id)
+        except KeyError:
+            pass
+        else:
+            return None  # failed recently
+        try:
+            user = await self.bot.get_user_info(user_id)
+        except discord.errors.NotFound:
+            self._user_negative_cache.set(user_id, True)
+            return None
+        except discord.errors.HTTPException as e:
+            # not cached, this can be a rate limit and the next call should try again
+            log.error(
+                "Received HTTPException when trying to get user info. "
+                "This is probaby a cooldown from Discord.",
+                exc_info=e,
+            )
+            return None
+        self._user_cache.set(user_id, user)
         return user
 
     async def _mute(self, member: discord.Member, reason: Optional[str] = None):
         """Mute an user on the guild."""
         guild = member.guild
-        role = guild.get_role(await self.data.guild(guild).mute_role())
+        role = guild.get_role((await self._get_settings(guild))["mute_role"])
         if not role:
             raise errors.MissingMuteRole("You need to create the mute role before doing this.")
         await member.add_roles(role, reason=reason)
@@ -133,7 +657,7 @@ class API:
     async def _unmute(self, member: discord.Member, reason: str):
         """Unmute an user on the guild."""
         guild = member.guild
-        role = guild.get_role(await self.data.guild(guild).mute_role())
+        role = guild.get_role((await self._get_settings(guild))["mute_role"])
         if not role:
             raise errors.MissingMuteRole(
                 f"Lost the mute role on guild {guild.name} (ID: {guild.id}"
@@ -151,22 +675,29 @@ class API:
         duration: Optional[timedelta] = None,
     ) -> dict:
         """Create a new case for a member. Don't call this, call warn instead."""
+        index = await self._get_case_index(guild)
         data = {
+            "id": index.next_id(),
             "level": level,
             "author": author
             if not isinstance(author, (discord.User, discord.Member))
             else author.id,
             "reason": reason,
-            "time": time.strftime("%a %d %B %Y %H:%M:%S"),
+            "time": int(time.timestamp()),
             "duration": None if not duration else self._format_timedelta(duration),
-            "until": None
-            if not duration
-            else (datetime.today() + duration).strftime("%a %d %B %Y %H:%M:%S"),
+            "until": None if not duration else int((time + duration).timestamp()),
         }
-        async with self.data.custom("MODLOGS", guild.id, user.id).x() as logs:
-            logs.append(data)
+        async with self._get_modlog_lock(guild):
+            await self.data.custom("MODLOGS", guild.id, user.id).cases.set_raw(
+                str(data["id"]), value=data
+            )
+            # the highest ID given is written, in case a concurrent warn finished before this one
+            await self.data.guild(guild).last_case_id.set(index.last_id)
+            await self._update_counters(guild, user.id, level, 1)
+            index.add(user.id, data, data["time"])
         return data
 
+    @timed
     async def get_case(
         self, guild: discord.Guild, user: Union[discord.User, discord.Member], index: int
     ) -> dict:
@@ -191,10 +722,13 @@ class API:
             .. code-block: python3
 
                 {
+                    "id"        : int,  # the ID of the case, unique in the guild
                     "level"     : int,  # between 1 and 5, the warning level
                     "author"    : Union[discord.Member, str],  # the member that warned the user
                     "reason"    : Optional[str],  # the reason of the warn, can be None
                     "time"      : datetime.datetime,  # the date when the warn was set
+                    "duration"  : Optional[str],  # the duration of a temporary mute/ban
+                    "until"     : Optional[datetime.datetime],  # the end of a temporary mute/ban
                 }
 
         Raises
@@ -202,18 +736,21 @@ class API:
         ~warnsystem.errors.NotFound
             The case requested doesn't exist.
         """
-        try:
-            case = (await self.data.custom("MODLOGS", guild.id, user.id).x())[index - 1]
-        except IndexError:
-            raise errors.NotFound("The case requested doesn't exist.")
-        else:
-            time = case["time"]
-            if time:
-                case["time"] = self._get_datetime(time)
-            return case
+        case = dict(await self._get_member_case(guild, user.id, index - 1))
+        del case["member"]
+        case["time"] = self._from_timestamp(case["time"])
+        case["until"] = self._from_timestamp(case.get("until"))
+        return case
 
+    @timed
     async def get_all_cases(
-        self, guild: discord.Guild, user: Optional[Union[discord.User, discord.Member]] = None
+        self,
+        guild: discord.Guild,
+        user: Optional[Union[discord.User, discord.Member]] = None,
+        *,
+        level: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
     ) -> list:
         """
         Get all cases for a member of a guild.
@@ -225,6 +762,12 @@ class API:
         user: Optional[Union[discord.User, discord.Member]]
             The user you want to get the cases from. If this arguments is omitted, all cases of
             the guild are returned.
+        level: Optional[int]
+            Only return the cases of this warning level.
+        since: Optional[datetime.datetime]
+            Only return the cases set after this date.
+        until: Optional[datetime.datetime]
+            Only return the cases set before this date.
 
         Returns
         -------
@@ -238,6 +781,7 @@ class API:
 
                 [
                     {  # case #1
+                        "id"        : int,  # the ID of the case, unique in the guild
                         "level"     : int,  # between 1 and 5, the warning level
                         "author"    : Union[discord.Member, str],  # the member that warned the user
                         "reason"    : Optional[str],  # the reason of the warn, can be None
@@ -256,6 +800,7 @@ class API:
             .. code-block:: python3
 
                 {  # case #1
+                    "id"        : int,  # the ID of the case, unique in the guild
                     "level"     : int,  # between 1 and 5, the warning level
                     "author"    : Union[discord.Member, str],  # the member that warned the user
                     "reason"    : Optional[str],  # the reason of the warn, can be None
@@ -264,23 +809,55 @@ class API:
                     "member"    : discord.User,  # the member warned, this key is specific to guild
                 }
         """
-        if user:
-            return await self.data.custom("MODLOGS", guild.id, user.id).x()
-        logs = await self.data.custom("MODLOGS", guild.id).all()
-        all_cases = []
-        for member, content in logs.items():
-            if member == "x":
-                continue
-            for log in content["x"]:
-                author = guild.get_member(log["author"])
-                time = log["time"]
-                if time:
-                    log["time"] = self._get_datetime(time)
-                log["member"] = self.bot.get_user(member)
-                log["author"] = author if author else log["author"]  # can be None or a string
-                all_cases.append(log)
-        return sorted(all_cases, key=lambda x: x["time"])  # sorted from oldest to newest
+        member = user.id if user else None
+        since = since.timestamp() if since else None
+        until = until.timestamp() if until else None
+        cases = [
+            [index.cases[x] for x in index.select(member, level, since=since, until=until)]
+            for index in await self._get_indexes(guild, member, since)
+        ]
+        if member is not None:
+            # the archived cases come first, like their position
+            cases = chain(*cases)
+        else:
+            # the cases of running temporary warns are not archived, the lists can overlap
+            cases = heapq.merge(*cases, key=lambda x: x["time"] or 0)
+        return [self._format_case(guild, x) for x in cases]
+
+    @timed
+    async def get_case_by_id(self, guild: discord.Guild, case_id: int) -> dict:
+        """
+        Get a case with its ID.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild where you want to get the case from.
+        case_id: int
+            The ID of the case, unique in the guild.
+
+        Returns
+        -------
+        dict
+            The case, with the same body as :func:`~warnsystem.api.API.get_case`, and the
+            ``"member"`` key giving the warned :class:`discord.User`.
+
+        Raises
+        ------
+        ~warnsystem.errors.NotFound
+            The case requested doesn't exist.
+        """
+        cases = await self._get_case_index(guild)
+        if case_id not in cases.by_id:
+            if (await self._get_settings(guild))["archive_horizon"] is not None:
+                cases = await self._get_archive(guild)
+        try:
+            case = cases.get_by_id(case_id)
+        except KeyError:
+            raise errors.NotFound("The case requested doesn't exist.")
+        return self._format_case(guild, case)
 
+    @timed
     async def edit_case(
         self,
         guild: discord.Guild,
@@ -307,6 +884,36 @@ class API:
         bool
             :py:obj:`True` if the action succeeded.
 
+        Raises
+        ------
+        ~warnsystem.errors.BadArgument
+            The reason is above 1024 characters. Due to Discord embed rules, you have to make it
+            shorter.
+        ~warnsystem.errors.NotFound
+            The case requested doesn't exist.
+        """
+        case = await self._get_member_case(guild, user.id, index - 1)
+        return await self.edit_case_by_id(guild, case["id"], new_reason)
+
+    @timed
+    async def edit_case_by_id(self, guild: discord.Guild, case_id: int, new_reason: str) -> bool:
+        """
+        Edit the reason of a case with its ID. Only this case is written in the config.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild where you want to get the case from.
+        case_id: int
+            The ID of the case, unique in the guild.
+        new_reason: str
+            The new reason to set.
+
+        Returns
+        -------
+        bool
+            :py:obj:`True` if the action succeeded.
+
         Raises
         ------
         ~warnsystem.errors.BadArgument
@@ -317,13 +924,278 @@ class API:
         """
         if len(new_reason) > 1024:
             raise errors.BadArgument("The reason must not be above 1024 characters.")
-        case = await self.get_case(guild, user, index)
-        case["reason"] = new_reason
-        case["time"] = case["time"].strftime("%a %d %B %Y %H:%M")
-        async with self.data.custom("MODLOGS", guild.id, user.id).x() as logs:
-            logs[index - 1] = case
+        cases = await self._get_case_index(guild)
+        async with self._get_modlog_lock(guild):
+            try:
+                case = cases.set_reason(case_id, new_reason)
+            except KeyError:
+                await self._edit_archive(guild, case_id, new_reason)
+                return True
+            await self.data.custom("MODLOGS", guild.id, case["member"]).cases.set_raw(
+                str(case_id), "reason", value=new_reason
+            )
+        return True
+
+    @timed
+    async def delete_case(
+        self, guild: discord.Guild, user: Union[discord.User, discord.Member], index: int
+    ) -> bool:
+        """
+        Delete a case.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild where you want to get the case from.
+        user: Union[discord.User, discord.Member]
+            The user you want to get the case from.
+        index: int
+            The number of the case you want to delete.
+
+        Returns
+        -------
+        bool
+            :py:obj:`True` if the action succeeded.
+
+        Raises
+        ------
+        ~warnsystem.errors.NotFound
+            The case requested doesn't exist.
+        """
+        case = await self._get_member_case(guild, user.id, index - 1)
+        return await self.delete_case_by_id(guild, case["id"])
+
+    @timed
+    async def delete_case_by_id(self, guild: discord.Guild, case_id: int) -> bool:
+        """
+        Delete a case with its ID. The ID is never given again to another case.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild where you want to get the case from.
+        case_id: int
+            The ID of the case, unique in the guild.
+
+        Returns
+        -------
+        bool
+            :py:obj:`True` if the action succeeded.
+
+        Raises
+        ------
+        ~warnsystem.errors.NotFound
+            The case requested doesn't exist.
+        """
+        cases = await self._get_case_index(guild)
+        async with self._get_modlog_lock(guild):
+            try:
+                case = cases.remove(case_id)
+            except KeyError:
+                case = await self._edit_archive(guild, case_id)
+                member = case["member"]
+                cases.archived[member] = max(cases.archived.get(member, 0) - 1, 0)
+                await self.data.custom("MODLOGS", guild.id, member).archived.set(
+                    cases.archived[member]
+                )
+            else:
+                await self.data.custom("MODLOGS", guild.id, case["member"]).cases.clear_raw(
+                    str(case_id)
+                )
+            await self._update_counters(guild, case["member"], case["level"], -1)
         return True
 
+    @timed
+    async def query_cases(
+        self,
+        guild: discord.Guild,
+        *,
+        member: Optional[Union[discord.User, discord.Member, int]] = None,
+        author: Optional[Union[discord.User, discord.Member, int]] = None,
+        levels: Optional[list] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ) -> tuple:
+        """
+        Get a page of the cases of a guild matching the filters.
+
+        Use this instead of :func:`~warnsystem.api.API.get_all_cases` if the guild can have a
+        lot of cases. Call it again with the returned cursor to get the next page.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild where you want to get the cases from.
+        member: Optional[Union[discord.User, discord.Member, int]]
+            Only return the cases of this member.
+        author: Optional[Union[discord.User, discord.Member, int]]
+            Only return the cases set by this moderator.
+        levels: Optional[list]
+            Only return the cases of these warning levels.
+        since: Optional[datetime.datetime]
+            Only return the cases set after this date.
+        until: Optional[datetime.datetime]
+            Only return the cases set before this date.
+        limit: int
+            The maximum number of cases in the page.
+        cursor: Optional[str]
+            The cursor returned by the previous call, to get the next page. Use the same
+            filters as the previous call.
+
+        Returns
+        -------
+        tuple
+            A tuple of two elements:
+
+            *   A list of the cases, sorted from the oldest to the newest. The cases have the
+                same format as the ones returned by
+                :func:`~warnsystem.api.API.get_all_cases` without a user specified.
+            *   The cursor to give for the next page, or :py:obj:`None` if this is the last
+                page.
+
+        Raises
+        ------
+        ~warnsystem.errors.BadArgument
+            The cursor is invalid.
+        """
+        if limit < 1:
+            raise errors.BadArgument("The limit must be above 0.")
+        # the cursor is the time of the last case returned, and the number of cases at that time
+        # that were already read, so it is still valid if the index is rebuilt
+        last_time, read = None, 0
+        start = since.timestamp() if since else None
+        if cursor:
+            try:
+                last_time, read = map(int, cursor.split(":"))
+            except ValueError:
+                raise errors.BadArgument("Invalid cursor.")
+            start = max(start, last_time) if start is not None else last_time
+        skip = read
+        end = until.timestamp() if until else None
+        member = getattr(member, "id", member)
+        author = getattr(author, "id", author)
+        # (index, key) of the archive and the config, sorted by time, the archive first on ties
+        keys = heapq.merge(
+            *[
+                zip(repeat(index), index.iter_keys(member, author, levels, since=start))
+                for index in await self._get_indexes(guild, member, start)
+            ],
+            key=lambda x: x[1][0],
+        )
+        page = []
+        next_cursor = None
+        for index, key in keys:
+            if skip and key[0] == last_time:
+                skip -= 1
+                continue
+            if end is not None and key[0] > end:
+                break
+            if len(page) == limit:
+                last = page[-1][1][0]
+                count = sum(1 for x in page if x[1][0] == last)
+                if last == last_time:
+                    count += read  # cases at that time read by the previous pages
+                next_cursor = f"{int(last)}:{count}"
+                break
+            page.append((index, key))
+        return [self._format_case(guild, index.cases[x]) for index, x in page], next_cursor
+
+    @timed
+    async def search_cases(
+        self,
+        guild: discord.Guild,
+        query: str,
+        level: Optional[int] = None,
+        since: Optional[datetime] = None,
+    ) -> list:
+        """
+        Search the cases of a guild by their reason.
+
+        A case is returned if its reason contains all the words of the query, case insensitive.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild where you want to search the cases.
+        query: str
+            The words to search.
+        level: Optional[int]
+            Only return the cases of this warning level.
+        since: Optional[datetime.datetime]
+            Only return the cases set after this date.
+
+        Returns
+        -------
+        list
+            A list of the cases found, sorted from the oldest to the newest. The cases have the
+            same format as the ones returned by :func:`~warnsystem.api.API.get_all_cases` without
+            a user specified.
+        """
+        since = since.timestamp() if since is not None else None
+        results = []
+        for index in await self._get_indexes(guild, since=since):
+            keys = index.search(query)
+            if since is not None:
+                keys = keys[bisect_left(keys, (since,)) :]
+            results.append([index.cases[x] for x in keys])
+        cases = heapq.merge(*results, key=lambda x: x["time"] or 0)
+        if level is not None:
+            cases = (x for x in cases if x["level"] == level)
+        return [self._format_case(guild, x) for x in cases]
+
+    @timed
+    async def export_cases(self, guild: discord.Guild, chunk_size: int = 1000):
+        """
+        Iterate over all cases of a guild, by chunks.
+
+        The cases are the raw data stored in the config, which can be serialized. The event
+        loop is released between each chunk.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild where you want to get the cases from.
+        chunk_size: int
+            The maximum number of cases in a chunk.
+
+        Yields
+        ------
+        list
+            A list of cases, sorted from the oldest to the newest:
+
+            .. code-block:: python3
+
+                {
+                    "member"    : int,  # the ID of the warned member
+                    "id"        : int,  # the ID of the case, unique in the guild
+                    "level"     : int,  # between 1 and 5, the warning level
+                    "author"    : Union[int, str],  # the ID of the moderator, or "Unknown"
+                    "reason"    : Optional[str],  # the reason of the warn, can be None
+                    "time"      : int,  # the timestamp of the warn
+                    "duration"  : Optional[str],  # the duration of a temporary warn
+                    "until"     : Optional[int],  # the timestamp of the end of the warn
+                }
+        """
+        # snapshot of the archive and the config, the indexes can change while we're iterating
+        keys = list(
+            heapq.merge(
+                *[list(zip(repeat(x), x.by_time)) for x in await self._get_indexes(guild)],
+                key=lambda x: x[1][0],
+            )
+        )
+        for i in range(0, len(keys), chunk_size):
+            chunk = []
+            for index, key in keys[i : i + chunk_size]:
+                try:
+                    chunk.append(dict(index.cases[key]))
+                except KeyError:
+                    continue  # deleted in the meantime
+            yield chunk
+            await asyncio.sleep(0)
+
+    @timed
     async def get_modlog_channel(
         self, guild: discord.Guild, level: Optional[Union[int, str]] = None
     ) -> discord.TextChannel:
@@ -390,11 +1262,12 @@ class API:
             elif isinstance(level, int) and not 1 <= level <= 5:
                 raise errors.InvalidLevel(msg)
 
+        channels = (await self._get_settings(guild))["channels"]
         if level == "all":
-            return await self.data.guild(guild).channels.all()
-        default_channel = await self.data.guild(guild).channels.main()
+            return dict(channels)
+        default_channel = channels["main"]
         if level:
-            channel = await self.data.guild(guild).channels.get_raw(str(level))
+            channel = channels[str(level)]
         else:
             return default_channel
 
@@ -407,46 +1280,157 @@ class API:
 
         return self.bot.get_channel(channel if channel else default_channel)
 
-    async def get_embeds(
+    async def _get_embed_template(
         self,
         guild: discord.Guild,
-        member: Union[discord.Member, discord.User],
         author: Union[discord.Member, str],
         level: int,
         reason: Optional[str] = None,
         time: Optional[timedelta] = None,
-        message_sent: bool = True,
-    ) -> tuple:
+    ) -> dict:
         """
-        Return two embeds, one for the modlog and one for the member.
+        Prepare the values of the embeds that don't depend on the warned member.
 
-        .. warning:: Unlike for the warning, the arguments are not checked and won't raise errors
-            if they are wrong. It is recommanded to call :func:`~warnsystem.api.API.warn` and let
-            it generate the embeds instead.
+        This is computed once for a mass warn, then :func:`_build_embeds` makes the embeds of
+        each member.
+        """
+        settings = await self._get_settings(guild)
+        log_description = settings["embed_description_modlog"][str(level)]
+        user_description = settings["embed_description_user"][str(level)]
+        if time:
+            duration = self._format_timedelta(time)
+        else:
+            duration = _("*[No time given]*")
+        return {
+            "author": author,
+            "level": level,
+            "reason": reason,
+            "time": time,
+            "duration": duration,
+            "today": datetime.today().strftime("%a %d %B %Y %H:%M"),
+            "log_description": log_description,
+            "user_description": user_description,
+            "need_invite": "{invite}" in log_description or "{invite}" in user_description,
+            "thumbnail": settings["thumbnails"][str(level)],
+            "color": settings["colors"][str(level)],
+            "url": settings["url"],
+            "show_mod": settings["show_mod"],
+        }
 
-        Parameters
-        ----------
-        guild: discord.Guild
-            The Discord guild where the warning takes place.
-        member: Union[discord.Member, discord.User]
-            The warned member. Should only be :class:`discord.User` in case of a hack ban.
-        author: Union[discord.Member, str]
-            The moderator that warned the user. If it's not a Discord user, you can specify a
-            :py:class:`str` instead (e.g. "Automod").
-        level: int
-            The level of the warning which should be between 1 and 5.
-        reason: Optional[str]
-            The reason of the warning.
-        time: Optional[timedelta]
-            The time before the action ends. Only for mute and ban.
-        message_sent: bool
-            Set to :py:obj:`False` if the embed couldn't be sent to the warned user.
+    def _get_invite_channel(self, guild: discord.Guild) -> Optional[discord.TextChannel]:
+        """Find the best channel for creating an invite."""
+        try:
+            return self._invite_channels[guild.id]
+        except KeyError:
+            pass
+        # we get the first one in the order of the guild, the one with the most members
+        # if some have the same position
+        channels = [
+            x for x in guild.text_channels if x.permissions_for(guild.me).create_instant_invite
+        ]
+        if channels:
+            position = min(x.position for x in channels)
+            channel = max(
+                [x for x in channels if x.position == position], key=lambda x: len(x.members)
+            )
+        else:
+            channel = None
+        self._invite_channels[guild.id] = channel
+        return channel
 
-        Returns
-        -------
-        tuple
-            A :py:class:`tuple` with the modlog embed at index 0, and the user embed at index 1.
+    def _invalidate_invite_channel(self, guild: discord.Guild):
+        """Forget the invite channel of a guild. Call this if the channels or permissions change."""
+        self._invite_channels.pop(guild.id, None)
+
+    def _take_invite(self, guild: discord.Guild) -> Optional[discord.Invite]:
         """
+        Take a valid invite from the pool of the guild, then refill it in the background.
+
+        Returns :py:obj:`None` if the pool is empty.
+        """
+        pool = self._invite_pools.get(guild.id) or []
+        limit = datetime.utcnow() + timedelta(seconds=INVITE_EXPIRATION_MARGIN)
+        invite = None
+        while pool:
+            invite = pool.pop(0)
+            if not invite.max_age or not invite.created_at:
+                break
+            if invite.created_at + timedelta(seconds=invite.max_age) > limit:
+                break
+            invite = None  # expired or expiring soon
+        self._refill_invites(guild)
+        return invite
+
+    def _get_invite(self, guild: discord.Guild):
+        """
+        Take an invite from the pool of the guild, then refill it in the background.
+
+        This never waits for Discord. If the pool is empty, a placeholder text is returned.
+        """
+        return self._take_invite(guild) or _("*[couldn't create an invite]*")
+
+    def _refill_invites(self, guild: discord.Guild):
+        """Start filling the invite pool of a guild in the background."""
+        if guild.id in self._invite_refills:
+            return
+        if datetime.now().timestamp() - self._invite_errors.get(guild.id, 0) < INVITE_RETRY_DELAY:
+            return
+        self._invite_refills.add(guild.id)
+        self.bot.loop.create_task(self._fill_invite_pool(guild))
+
+    async def _fill_invite_pool(self, guild: discord.Guild):
+        pool = self._invite_pools.setdefault(guild.id, [])
+        try:
+            while len(pool) < INVITE_POOL_SIZE:
+                channel = self._get_invite_channel(guild)
+                if not channel:
+                    raise errors.MissingPermissions("Cannot create invites in any channel.")
+                pool.append(
+                    await channel.create_invite(
+                        max_uses=1, reason=_("WarnSystem invite for the warned members.")
+                    )
+                )
+        except Exception as e:
+            self._invite_errors[guild.id] = datetime.now().timestamp()
+            self._invalidate_invite_channel(guild)
+            log.warn(f"Couldn't create invites for guild {guild} (ID: {guild.id}).", exc_info=e)
+        finally:
+            self._invite_refills.discard(guild.id)
+
+    async def _fill_all_invite_pools(self):
+        """Prepare the invites of all guilds using the {invite} placeholder or the reinvites."""
+        for guild_id, data in (await self.data.all_guilds()).items():
+            descriptions = list(data["embed_description_modlog"].values()) + list(
+                data["embed_description_user"].values()
+            )
+            if not data["reinvite"] and not any("{invite}" in x for x in descriptions):
+                continue
+            guild = self.bot.get_guild(guild_id)
+            if guild:
+                self._refill_invites(guild)
+
+    def _add_undelivered_notice(self, embed: discord.Embed):
+        """Tell in the modlog embed that the member didn't receive the DM."""
+        embed.description += _(
+            "\n\n***The message couldn't be delivered to the member. We may don't "
+            "have a server in common or he blocked me/messages from this guild.***"
+        )
+
+    def _build_embeds(
+        self,
+        template: dict,
+        member: Union[discord.Member, discord.User],
+        counters: dict,
+        invite=None,
+        message_sent: bool = True,
+    ) -> tuple:
+        """Make the embeds of a member from the template given by _get_embed_template."""
+        author = template["author"]
+        level = template["level"]
+        reason = template["reason"]
+        time = template["time"]
+        duration = template["duration"]
+        today = template["today"]
         action = {
             1: (_("warn"), _("warns")),
             2: (_("mute"), _("mutes")),
@@ -458,13 +1442,10 @@ class API:
         if not reason:
             reason = _("No reason was provided.")
             mod_message = _("\nEdit this with `[p]warnings @{name}`").format(name=str(member))
-        logs = await self.data.custom("MODLOGS", guild.id, member.id).x()
 
         # prepare the status field
-        total_warns = len(logs) + 1
-        total_type_warns = (
-            len([x for x in logs if x["level"] == level]) + 1
-        )  # number of warns of the received type
+        total_warns = counters["total"] + 1
+        total_type_warns = counters[str(level)] + 1  # number of warns of the received type
 
         # a lambda that returns a string; if True is given, a third person sentence is returned
         # (modlog), if False is given, a first person sentence is returned (DM user)
@@ -478,26 +1459,6 @@ class API:
             total_type=total_type_warns,
             action=action[1] if total_type_warns > 1 else action[0],
         )
-
-        # we set any value that can be used multiple times
-        invite = None
-        log_description = await self.data.guild(guild).embed_description_modlog.get_raw(level)
-        if "{invite}" in log_description:
-            try:
-                invite = await guild.create_invite(max_uses=1)
-            except Exception:
-                invite = _("*[couldn't create an invite]*")
-        user_description = await self.data.guild(guild).embed_description_user.get_raw(level)
-        if "{invite}" in user_description and not invite:
-            try:
-                invite = await guild.create_invite(max_uses=1)
-            except Exception:
-                invite = _("*[couldn't create an invite]*")
-        today = datetime.today().strftime("%a %d %B %Y %H:%M")
-        if time:
-            duration = self._format_timedelta(time)
-        else:
-            duration = _("*[No time given]*")
         format_description = lambda x: x.format(
             invite=invite, member=member, mod=author, duration=duration, time=today
         )
@@ -508,7 +1469,7 @@ class API:
         log_embed.title = _("Level {level} warning ({action})").format(
             level=level, action=action[0]
         )
-        log_embed.description = format_description(log_description)
+        log_embed.description = format_description(template["log_description"])
         log_embed.add_field(name=_("Member"), value=member.mention, inline=True)
         log_embed.add_field(name=_("Moderator"), value=author.mention, inline=True)
         if time:
@@ -516,41 +1477,306 @@ class API:
         log_embed.add_field(name=_("Reason"), value=reason + mod_message, inline=False)
         log_embed.add_field(name=_("Status"), value=current_status(True), inline=False)
         log_embed.set_footer(text=today)
-        log_embed.set_thumbnail(url=await self.data.guild(guild).thumbnails.get_raw(level))
-        log_embed.color = await self.data.guild(guild).colors.get_raw(level)
-        log_embed.url = await self.data.guild(guild).url()
+        log_embed.set_thumbnail(url=template["thumbnail"])
+        log_embed.color = template["color"]
+        log_embed.url = template["url"]
         if not message_sent:
-            log_embed.description += _(
-                "\n\n***The message couldn't be delivered to the member. We may don't "
-                "have a server in common or he blocked me/messages from this guild.***"
-            )
+            self._add_undelivered_notice(log_embed)
 
         # embed for the member in DM
         user_embed = deepcopy(log_embed)
         user_embed.set_author(name="")
-        user_embed.description = format_description(user_description)
+        user_embed.description = format_description(template["user_description"])
         if mod_message:
             user_embed.set_field_at(3 if time else 2, name=_("Reason"), value=reason)
         user_embed.remove_field(4 if time else 3)  # removes status field (gonna be added back)
         user_embed.remove_field(0)  # removes member field
         user_embed.add_field(name=_("Status"), value=current_status(False), inline=False)
         if time:
-            user_embed.set_field_at(
-                1, name=_("Duration"), value=self._format_timedelta(time), inline=True
-            )
-        if not await self.data.guild(guild).show_mod():
+            user_embed.set_field_at(1, name=_("Duration"), value=duration, inline=True)
+        if not template["show_mod"]:
             user_embed.remove_field(0)  # called twice, removing moderator field
 
         return (log_embed, user_embed)
 
-    async def maybe_create_mute_role(self, guild: discord.Guild) -> bool:
+    @timed
+    async def get_embeds(
+        self,
+        guild: discord.Guild,
+        member: Union[discord.Member, discord.User],
+        author: Union[discord.Member, str],
+        level: int,
+        reason: Optional[str] = None,
+        time: Optional[timedelta] = None,
+        message_sent: bool = True,
+    ) -> tuple:
+        """
+        Return two embeds, one for the modlog and one for the member.
+
+        .. warning:: Unlike for the warning, the arguments are not checked and won't raise errors
+            if they are wrong. It is recommanded to call :func:`~warnsystem.api.API.warn` and let
+            it generate the embeds instead.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The Discord guild where the warning takes place.
+        member: Union[discord.Member, discord.User]
+            The warned member. Should only be :class:`discord.User` in case of a hack ban.
+        author: Union[discord.Member, str]
+            The moderator that warned the user. If it's not a Discord user, you can specify a
+            :py:class:`str` instead (e.g. "Automod").
+        level: int
+            The level of the warning which should be between 1 and 5.
+        reason: Optional[str]
+            The reason of the warning.
+        time: Optional[timedelta]
+            The time before the action ends. Only for mute and ban.
+        message_sent: bool
+            Set to :py:obj:`False` if the embed couldn't be sent to the warned user.
+
+        Returns
+        -------
+        tuple
+            A :py:class:`tuple` with the modlog embed at index 0, and the user embed at index 1.
+        """
+        template = await self._get_embed_template(guild, author, level, reason, time)
+        counters = await self._get_counters(guild, member)
+        invite = self._get_invite(guild) if template["need_invite"] else None
+        return self._build_embeds(template, member, counters, invite, message_sent)
+
+    def _get_mute_overwrite(self, channel: discord.abc.GuildChannel) -> dict:
+        """Get the permissions denied to the mute role in a channel, depending on its type."""
+        if isinstance(channel, discord.TextChannel):
+            return {"send_messages": False, "add_reactions": False}
+        if isinstance(channel, discord.VoiceChannel):
+            return {"speak": False}
+        # categories, so the channels synced with it are also covered
+        return {"send_messages": False, "add_reactions": False, "speak": False}
+
+    async def _set_mute_overwrite(
+        self, channel: discord.abc.GuildChannel, role: discord.Role
+    ) -> Optional[str]:
+        """
+        Deny the permissions to the mute role in a channel.
+
+        Returns the message explaining the error if it failed, else :py:obj:`None`.
+        """
+        guild = channel.guild
+        try:
+            await channel.set_permissions(
+                role,
+                **self._get_mute_overwrite(channel),
+                reason=_(
+                    "Setting up WarnSystem mute. All muted members will have this role, "
+                    "feel free to edit its permissions."
+                ),
+            )
+        except discord.errors.Forbidden:
+            return _(
+                "Cannot edit permissions of the channel {channel} because of a "
+                "permission error (probably enforced permission for `Manage channel`)."
+            ).format(channel=channel.mention)
+        except discord.errors.HTTPException as e:
+            log.warn(
+                f"Couldn't edit permissions of {channel} (ID: {channel.id}) in guild "
+                f"{guild.name} (ID: {guild.id}) for setting up the mute role because "
+                "of an HTTPException.",
+                exc_info=e,
+            )
+        except Exception as e:
+            log.error(
+                f"Couldn't edit permissions of {channel} (ID: {channel.id}) in guild "
+                f"{guild.name} (ID: {guild.id}) for setting up the mute role because "
+                "of an unknwon error.",
+                exc_info=e,
+            )
+        else:
+            return None
+        return _(
+            "Cannot edit permissions of the channel {channel} because of an unknown error."
+        ).format(channel=channel.mention)
+
+    async def _check_mute_overwrite(self, channel: discord.abc.GuildChannel):
+        """
+        Set the mute role overwrite in a channel if it's missing.
+
+        The overwrite is only set if the role has no overwrite at all in the channel. If it was
+        edited by an admin, the new overwrite is kept.
+        """
+        if not isinstance(
+            channel, (discord.TextChannel, discord.VoiceChannel, discord.CategoryChannel)
+        ):
+            return
+        guild = channel.guild
+        role = guild.get_role((await self._get_settings(guild))["mute_role"])
+        if not role:
+            return
+        known = self._mute_overwrites.setdefault(role.id, {})
+        overwrite = channel.overwrites_for(role)
+        if overwrite.is_empty() and guild.me.guild_permissions.manage_roles:
+            error = await self._set_mute_overwrite(channel, role)
+            if error is None:
+                log.debug(f"Added the missing mute overwrite in {channel} (ID: {channel.id}).")
+                overwrite = discord.PermissionOverwrite(**self._get_mute_overwrite(channel))
+            # if it failed, the empty overwrite is kept until the channel is edited again
+        known[channel.id] = tuple(x.value for x in overwrite.pair())
+
+    async def _check_mute_drift(self):
+        """
+        Compare the mute overwrites of all guilds to the last known state, and check the
+        channels that changed.
+        """
+        for guild in self.bot.guilds:
+            role = guild.get_role((await self._get_settings(guild))["mute_role"])
+            if not role:
+                continue
+            known = self._mute_overwrites.get(role.id, {})
+            # forget the deleted channels
+            self._mute_overwrites[role.id] = {
+                x.id: known[x.id] for x in guild.channels if x.id in known
+            }
+            for channel in guild.channels:
+                current = tuple(x.value for x in channel.overwrites_for(role).pair())
+                if known.get(channel.id) != current:
+                    await self._check_mute_overwrite(channel)
+
+    def _get_stats(self) -> dict:
+        """Get the statistics of the API calls, the temporary warns and the user cache."""
+        return {
+            **self._stats.to_dict(),
+            "expirations": dict(self._timer_stats),
+            "user_cache": {
+                "size": len(self._user_cache),
+                "hits": self._user_cache.hits,
+                "misses": self._user_cache.misses,
+                "negative_hits": self._user_negative_cache.hits,
+            },
+        }
+
+    async def _dump_stats_loop(self, path: Path):
+        """Infinite loop task started with the cog that writes the statistics in a file."""
+        while True:
+            await asyncio.sleep(STATS_DUMP_INTERVAL)
+            content = json.dumps(self._get_stats(), indent=2)
+            try:
+                await self.bot.loop.run_in_executor(None, path.write_text, content)
+            except OSError as e:
+                log.warn(f"Couldn't write the statistics at {path}.", exc_info=e)
+
+    async def _archive_cases(self, guild: discord.Guild, days: int) -> int:
+        """
+        Move the cases older than the given number of days from the config to the archive file
+        of the guild, and return the number of cases archived.
+
+        The cases are written to the archive before being removed from the config, so nothing
+        is lost if this fails. The counters of the members are kept. The cases of temporary
+        warns that are not finished yet are not archived.
+
+        The archived cases of a member must come before the ones in the config to keep their
+        positions, so the cases of a member are only archived up to the first one that can't
+        be.
+        """
+        now = int(datetime.now().timestamp())
+        cutoff = now - days * 86400
+        index = await self._get_case_index(guild)
+        async with self._get_modlog_lock(guild):
+            cases = []
+            for keys in index.by_member.values():
+                for key in keys:
+                    case = index.cases[key]
+                    if key[0] > cutoff or (case.get("until") or 0) > now:
+                        # archiving the next cases would change the position of this one
+                        break
+                    cases.append(dict(case))
+            if not cases:
+                return 0
+            async with self._archives_lock:
+                await self.bot.loop.run_in_executor(
+                    None, self._write_archive, self._get_archive_file(guild), cases
+                )
+                self._archives.pop(guild.id)  # read again with the new cases
+            # queries for cases older than this read the archive
+            horizon = (await self._get_settings(guild))["archive_horizon"] or 0
+            await self.data.guild(guild).archive_horizon.set(max(horizon, cutoff + 1))
+            self._invalidate_settings(guild)
+            # only the members with archived cases are written
+            by_member = {}
+            for case in cases:
+                by_member.setdefault(case["member"], []).append(case["id"])
+            for member, case_ids in by_member.items():
+                group = self.data.custom("MODLOGS", guild.id, member)
+                async with group.cases() as member_cases:
+                    for case_id in case_ids:
+                        del member_cases[str(case_id)]
+                archived = index.archived.get(member, 0) + len(case_ids)
+                await group.archived.set(archived)
+                for case_id in case_ids:
+                    index.remove(case_id)
+                index.archived[member] = archived
+            # read while the cases were still in the config, they were removed from it
+            self._archives.pop(guild.id)
+        log.info(f"Archived {len(cases)} cases of guild {guild} (ID: {guild.id}).")
+        return len(cases)
+
+    async def _archive_loop(self):
+        """
+        Infinite loop task started with the cog that archives the old cases of the guilds with
+        an archival policy.
+        """
+        if self._archive_path is None:
+            return
+        await self.bot.wait_until_ready()
+        while True:
+            for guild_id, data in (await self.data.all_guilds()).items():
+                guild = self.bot.get_guild(guild_id)
+                if not guild or not data.get("archive_after"):
+                    continue
+                try:
+                    await self._archive_cases(guild, data["archive_after"])
+                except Exception as e:
+                    log.error(
+                        f"Error while archiving the cases of guild {guild} (ID: {guild.id}).",
+                        exc_info=e,
+                    )
+            await asyncio.sleep(ARCHIVE_INTERVAL)
+
+    async def _mute_drift_loop(self):
+        """
+        Infinite loop task started with the cog that checks the mute overwrites periodically.
+        Channels are also checked on their creation and update.
+        """
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                await self._check_mute_drift()
+            except Exception as e:
+                log.error("Error while checking the mute role overwrites.", exc_info=e)
+            await asyncio.sleep(MUTE_DRIFT_INTERVAL)
+
+    @timed
+    async def maybe_create_mute_role(
+        self,
+        guild: discord.Guild,
+        concurrency: int = MUTE_OVERWRITE_CONCURRENCY,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> bool:
         """
         Create the mod role for WarnSystem if it doesn't exist.
 
+        The permissions of the role are then denied in all text channels, voice channels and
+        categories of the guild.
+
         Parameters
         ----------
         guild: discord.Guild
             The guild you want to set up the mute in.
+        concurrency: int
+            The maximum number of channels edited at the same time. discord.py will still wait
+            if the rate limits are reached.
+        progress: Optional[Callable[[int, int], None]]
+            A function called each time a channel is edited, with the number of channels
+            edited and the total number of channels.
 
         Returns
         -------
@@ -567,7 +1793,7 @@ class API:
         discord.errors.HTTPException
             Creating the role failed.
         """
-        role = await self.data.guild(guild).mute_role()
+        role = (await self._get_settings(guild))["mute_role"]
         role = guild.get_role(role)
         if role:
             return False
@@ -593,54 +1819,29 @@ class API:
                 "I can add it to muted members."
             ),
         )
-        errors = []
-        for channel in [x for x in guild.channels if isinstance(x, discord.TextChannel)]:
-            try:
-                await channel.set_permissions(
-                    role,
-                    send_messages=False,
-                    add_reactions=False,
-                    reason=_(
-                        "Setting up WarnSystem mute. All muted members will have this role, "
-                        "feel free to edit its permissions."
-                    ),
-                )
-            except discord.errors.Forbidden:
-                errors.append(
-                    _(
-                        "Cannot edit permissions of the channel {channel} because of a "
-                        "permission error (probably enforced permission for `Manage channel`)."
-                    ).format(channel=channel.mention)
-                )
-            except discord.errors.HTTPException as e:
-                errors.append(
-                    _(
-                        "Cannot edit permissions of the channel {channel} because of "
-                        "an unknown error."
-                    ).format(channel=channel.mention)
-                )
-                log.warn(
-                    f"Couldn't edit permissions of {channel} (ID: {channel.id}) in guild "
-                    f"{guild.name} (ID: {guild.id}) for setting up the mute role because "
-                    "of an HTTPException.",
-                    exc_info=e,
-                )
-            except Exception as e:
-                errors.append(
-                    _(
-                        "Cannot edit permissions of the channel {channel} because of "
-                        "an unknown error."
-                    ).format(channel=channel.mention)
-                )
-                log.error(
-                    f"Couldn't edit permissions of {channel} (ID: {channel.id}) in guild "
-                    f"{guild.name} (ID: {guild.id}) for setting up the mute role because "
-                    "of an unknwon error.",
-                    exc_info=e,
-                )
+        channels = [
+            x
+            for x in guild.channels
+            if isinstance(x, (discord.TextChannel, discord.VoiceChannel, discord.CategoryChannel))
+        ]
+        semaphore = asyncio.Semaphore(concurrency)
+        done = 0
+
+        async def edit_channel(channel):
+            nonlocal done
+            async with semaphore:
+                error = await self._set_mute_overwrite(channel, role)
+            done += 1
+            if progress:
+                progress(done, len(channels))
+            return error
+
+        fails = await asyncio.gather(*[edit_channel(x) for x in channels])
         await self.data.guild(guild).mute_role.set(role.id)
-        return errors
+        self._invalidate_settings(guild)
+        return [x for x in fails if x]
 
+    @timed
     async def format_reason(self, guild: discord.Guild, reason: str = None) -> str:
         """
         Reformat a reason with the substitutions set on the guild.
@@ -659,116 +1860,34 @@ class API:
         """
         if not reason:
             return
-        substitutions = await self.data.guild(guild).substitutions()
-        for key, substitute in substitutions.items():
-            reason = reason.replace(f"[{key}]", substitute)
-        return reason
-
-    async def warn(
-        self,
-        guild: discord.Guild,
-        member: Union[discord.Member, int],
-        author: Union[discord.Member, str],
-        level: int,
-        reason: Optional[str] = None,
-        time: Optional[timedelta] = None,
-        log_modlog: bool = True,
-        log_dm: bool = True,
-        take_action: bool = True,
-    ) -> bool:
+        substitutions = (await self._get_settings(guild))["substitutions"]
+        if not substitutions:
+            return reason
+        try:
+            cached, pattern = self._substitution_patterns[guild.id]
+        except KeyError:
+            cached = None
+        if cached is not substitutions:
+            # the settings were edited since the pattern was compiled
+            pattern = re.compile(r"\[(" + "|".join(map(re.escape, substitutions)) + r")\]")
+            self._substitution_patterns[guild.id] = (substitutions, pattern)
+        return pattern.sub(lambda x: substitutions[x.group(1)], reason)
+
+    async def _check_warn(self, guild: discord.Guild, level: int) -> tuple:
         """
-        Set a warning on a member of a Discord guild and log it with the WarnSystem system.
-
-        .. tip:: The message that comes with the following exceptions are already
-            translated and ready to be sent to Discord:
-
-            *   :class:`~warnsystem.errors.NotFound`
-            *   :class:`~warnsystem.errors.LostPermissions`
-            *   :class:`~warnsystem.errors.MemberTooHigh`
-            *   :class:`~warnsystem.errors.MissingPermissions`
-
-        Parameters
-        ----------
-        guild: discord.Guild
-            The guild of the member to warn
-        member: Union[discord.Member, int]
-            The member that will be warned. It can be an :py:class:`int` only if you need to
-            ban someone not in the guild.
-        author: Union[discord.Member, str]
-            The member that called the action, which will be associated to the log.
-        level: int
-            An :py:class:`int` between 1 and 5, specifying the warning level:
-
-            #.  Simple DM warning
-            #.  Mute (can be temporary)
-            #.  Kick
-            #.  Softban
-            #.  Ban (can be temporary ban, or hack ban, if the member is not in the server)
-        reason: Optional[str]
-            The optional reason of the warning. It is strongly recommanded to set one.
-        time: Optional[timedelta]
-            The time before cancelling the action. This only works for a mute or a ban.
-        log_modlog: bool
-            Specify if an embed should be posted to the modlog channel. Default to :py:obj:`True`.
-        log_dm: bool
-            Specify if an embed should be sent to the warned user. Default to :py:obj:`True`.
-        take_action: bool
-            Specify if the bot should take action on the member (mute, kick, softban, ban). If set
-            to :py:obj:`False`, the bot will only send a log embed to the member and in the modlog.
-            Default to :py:obj:`True`.
-
-        Returns
-        -------
-        bool
-            :py:obj:`True` if the action was successful.
+        Check everything that doesn't depend on the warned member before a warning.
 
-        Raises
-        ------
-        ~warnsystem.errors.InvalidLevel
-            The level must be an :py:class:`int` between 1 and 5.
-        ~warnsystem.errors.BadArgument
-            You need to provide a valid :class:`discord.Member` object, except for a
-            hackban where a :class:`discord.User` works.
-        ~warnsystem.errors.NotFound
-            You provided an :py:class:`int` for a hackban, but the bot couldn't find
-            it by calling :func:`discord.Client.get_user_info`.
-        ~warnsystem.errors.MissingMuteRole
-            You're trying to mute someone but the mute role was not setup yet.
-            You can fix this by calling :func:`~warnsystem.api.API.maybe_create_mute_role`.
-        ~warnsystem.errors.LostPermissions
-            The bot lost a permission to do something (it had the perm before). This
-            can be lost permissions for sending messages to the modlog channel or
-            interacting with the mute role.
-        ~warnsystem.errors.MemberTooHigh
-            The bot is trying to take actions on someone but his top role is higher
-            than the bot's top role in the guild's hierarchy.
-        ~warnsystem.errors.NotAllowedByHierarchy
-            The moderator trying to warn someone is lower than him in the role hierarchy,
-            while the bot still has permissions to act. This is raised only if the
-            hierarchy check is enabled.
-        ~warnsystem.errors.MissingPermissions
-            The bot lacks a permissions to do something. Can be adding role, kicking
-            or banning members.
-        discord.errors.HTTPException
-            Unknown error from Discord API. It's recommanded to catch this
-            potential error too.
+        Returns a :py:class:`tuple` with the modlog channel and the mute role.
         """
         if not isinstance(level, int) or not 1 <= level <= 5:
             raise errors.InvalidLevel("The level must be between 1 and 5.")
-        if isinstance(member, int):
-            if level != 5:
-                raise errors.BadArgument(
-                    "You need to provide a valid discord.Member object for this action."
-                )
-            member = await self._get_user_info(member)
-            if not member:
-                raise errors.NotFound(_("The requested member does not exist."))
+        settings = await self._get_settings(guild)
 
         # we get the modlog channel now to make sure it exists before doing anything
         mod_channel = await self.get_modlog_channel(guild, level)
 
         # check that the mute role exists
-        mute_role = guild.get_role(await self.data.guild(guild).mute_role())
+        mute_role = guild.get_role(settings["mute_role"])
         if not mute_role and level == 2:
             raise errors.MissingMuteRole("You need to create the mute role before doing this.")
 
@@ -785,31 +1904,6 @@ class API:
                     "permissions in {channel} to do this."
                 ).format(channel=mod_channel.mention)
             )
-        if (
-            level > 1
-            and isinstance(member, discord.Member)
-            and guild.me.top_role.position <= member.top_role.position
-        ):
-            # check if the member is below the bot in the roles's hierarchy
-            raise errors.MemberTooHigh(
-                _(
-                    "Cannot take actions on this member, he is above me in the roles hierarchy. "
-                    "Modify the hierarchy so my top role ({bot_role}) is above {member_role}."
-                ).format(bot_role=guild.me.top_role.name, member_role=member.top_role.name)
-            )
-        if (
-            isinstance(member, discord.Member)
-            and await self.data.guild(guild).respect_hierarchy()
-            and (
-                member.top_role >= author.top_role
-                and not (self.bot.is_owner(author) or author.owner)
-            )
-        ):
-            raise errors.NotAllowedByHierarchy(
-                "The moderator is lower than the member in the servers's role hierarchy."
-            )
-        if level > 2 and isinstance(member, discord.Member) and member == guild.owner:
-            raise errors.MissingPermissions(_("I can't take actions on the owner of the guild."))
         if level == 2:
             # mute with role
             if not guild.me.guild_permissions.manage_roles:
@@ -835,34 +1929,96 @@ class API:
                 raise errors.MissingPermissions(
                     _("I can't ban members, please give me this permission to continue.")
                 )
+        return (mod_channel, mute_role)
 
-        # send the message to the user
-        if log_modlog or log_dm:
-            modlog_e, user_e = await self.get_embeds(guild, member, author, level, reason, time)
-        if log_dm:
+    async def _get_warned_user(
+        self, member: Union[discord.Member, int], level: int
+    ) -> Union[discord.Member, discord.User]:
+        """Get the user object of a hack ban."""
+        if isinstance(member, int):
+            if level != 5:
+                raise errors.BadArgument(
+                    "You need to provide a valid discord.Member object for this action."
+                )
+            member = await self._get_user_info(member)
+            if not member:
+                raise errors.NotFound(_("The requested member does not exist."))
+        return member
+
+    async def _check_member(
+        self,
+        guild: discord.Guild,
+        member: Union[discord.Member, discord.User],
+        author: Union[discord.Member, str],
+        level: int,
+    ):
+        """Check the permissions specific to the warned member before a warning."""
+        if not isinstance(member, discord.Member):
+            return
+        if level > 1 and guild.me.top_role.position <= member.top_role.position:
+            # check if the member is below the bot in the roles's hierarchy
+            raise errors.MemberTooHigh(
+                _(
+                    "Cannot take actions on this member, he is above me in the roles hierarchy. "
+                    "Modify the hierarchy so my top role ({bot_role}) is above {member_role}."
+                ).format(bot_role=guild.me.top_role.name, member_role=member.top_role.name)
+            )
+        if (
+            isinstance(author, discord.Member)
+            and (await self._get_settings(guild))["respect_hierarchy"]
+            and member.top_role >= author.top_role
+            and not (author == guild.owner or await self.bot.is_owner(author))
+        ):
+            raise errors.NotAllowedByHierarchy(
+                "The moderator is lower than the member in the servers's role hierarchy."
+            )
+        if level > 2 and member == guild.owner:
+            raise errors.MissingPermissions(_("I can't take actions on the owner of the guild."))
+
+    async def _warn_member(
+        self,
+        guild: discord.Guild,
+        member: Union[discord.Member, discord.User],
+        author: Union[discord.Member, str],
+        level: int,
+        reason: Optional[str],
+        time: Optional[timedelta],
+        log_modlog: bool,
+        log_dm: bool,
+        take_action: bool,
+        mod_channel: discord.TextChannel,
+        template: Optional[dict],
+    ):
+        """
+        Warn a member once all checks are done. Don't call this, call warn instead.
+
+        The stages that don't depend on each other run at the same time:
+
+        *   The DM is sent while the member is muted, but before a kick or a ban, else we
+            may not share a server anymore.
+        *   The modlog embed is queued and the case is written once the action succeeded.
+        """
+        settings = await self._get_settings(guild)
+
+        async def send_dm() -> bool:
             try:
-                await member.send(embed=user_e)
+                async with self._stats.measure("warn.dm"):
+                    await member.send(embed=user_e)
             except discord.errors.Forbidden:
-                modlog_e, user_e = await self.get_embeds(
-                    guild, member, author, level, reason, time, message_sent=False
-                )
+                return False
             except discord.errors.HTTPException as e:
-                modlog_e, user_e = await self.get_embeds(
-                    guild, member, author, level, reason, time, message_sent=False
-                )
                 log.warn(
                     f"Couldn't send a message to {member} (ID: {member.id}) "
                     "because of an HTTPException.",
                     exc_info=e,
                 )
+                return False
+            return True
 
-        # take actions
-        if take_action:
+        async def take_actions():
             action = {1: _("warn"), 2: _("mute"), 3: _("kick"), 4: _("softban"), 5: _("ban")}.get(
                 level, _("unknown")
             )
-            if reason and not reason.endswith("."):
-                reason += "."
             audit_reason = (
                 _(
                     "WarnSystem {action} requested by {author} (ID: "
@@ -885,9 +2041,7 @@ class API:
                 await guild.kick(member, reason=audit_reason)
             if level == 4:
                 await guild.ban(
-                    member,
-                    reason=audit_reason,
-                    delete_message_days=await self.data.guild(guild).bandays.softban(),
+                    member, reason=audit_reason, delete_message_days=settings["bandays"]["softban"]
                 )
                 await guild.unban(
                     member,
@@ -895,168 +2049,463 @@ class API:
                 )
             if level == 5:
                 await guild.ban(
-                    member,
-                    reason=audit_reason,
-                    delete_message_days=await self.data.guild(guild).bandays.ban(),
+                    member, reason=audit_reason, delete_message_days=settings["bandays"]["ban"]
                 )
 
+        if log_modlog or log_dm:
+            async with self._stats.measure("warn.embeds"):
+                counters = await self._get_counters(guild, member)
+                invite = self._get_invite(guild) if template["need_invite"] else None
+                modlog_e, user_e = self._build_embeds(template, member, counters, invite)
+
+        if take_action and reason and not reason.endswith("."):
+            reason += "."
+        dm_task = None
+        if log_dm:
+            dm_task = asyncio.ensure_future(send_dm())
+            if take_action and level > 2:
+                # the member must receive the message before leaving the server
+                await dm_task
+        if take_action:
+            async with self._stats.measure("warn.action"):
+                await take_actions()
+        if dm_task and not await dm_task:
+            self._add_undelivered_notice(modlog_e)
+
         # actions were taken, time to log
         if log_modlog:
-            await mod_channel.send(embed=modlog_e)
-        data = await self._create_case(guild, member, author, level, datetime.now(), reason, time)
+            async with self._stats.measure("warn.modlog"):
+                self._send_modlog(mod_channel, modlog_e)
+        async with self._stats.measure("warn.case"):
+            data = await self._create_case(
+                guild, member, author, level, datetime.now(), reason, time
+            )
+            # start timer if there is a temporary warning
+            if time and (level == 2 or level == 5):
+                data["member"] = member.id
+                await self._start_timer(guild, data)
+
+    @timed
+    async def warn(
+        self,
+        guild: discord.Guild,
+        member: Union[discord.Member, int],
+        author: Union[discord.Member, str],
+        level: int,
+        reason: Optional[str] = None,
+        time: Optional[timedelta] = None,
+        log_modlog: bool = True,
+        log_dm: bool = True,
+        take_action: bool = True,
+    ) -> bool:
+        """
+        Set a warning on a member of a Discord guild and log it with the WarnSystem system.
 
-        # start timer if there is a temporary warning
-        if time and (level == 2 or level == 5):
-            data["member"] = member.id
-            await self._start_timer(guild, data)
+        .. tip:: The message that comes with the following exceptions are already
+            translated and ready to be sent to Discord:
+
+            *   :class:`~warnsystem.errors.NotFound`
+            *   :class:`~warnsystem.errors.LostPermissions`
+            *   :class:`~warnsystem.errors.MemberTooHigh`
+            *   :class:`~warnsystem.errors.MissingPermissions`
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild of the member to warn
+        member: Union[discord.Member, int]
+            The member that will be warned. It can be an :py:class:`int` only if you need to
+            ban someone not in the guild.
+        author: Union[discord.Member, str]
+            The member that called the action, which will be associated to the log.
+        level: int
+            An :py:class:`int` between 1 and 5, specifying the warning level:
+
+            #.  Simple DM warning
+            #.  Mute (can be temporary)
+            #.  Kick
+            #.  Softban
+            #.  Ban (can be temporary ban, or hack ban, if the member is not in the server)
+        reason: Optional[str]
+            The optional reason of the warning. It is strongly recommanded to set one.
+        time: Optional[timedelta]
+            The time before cancelling the action. This only works for a mute or a ban.
+        log_modlog: bool
+            Specify if an embed should be posted to the modlog channel. Default to :py:obj:`True`.
+        log_dm: bool
+            Specify if an embed should be sent to the warned user. Default to :py:obj:`True`.
+        take_action: bool
+            Specify if the bot should take action on the member (mute, kick, softban, ban). If set
+            to :py:obj:`False`, the bot will only send a log embed to the member and in the modlog.
+            Default to :py:obj:`True`.
+
+        Returns
+        -------
+        bool
+            :py:obj:`True` if the action was successful.
+
+        Raises
+        ------
+        ~warnsystem.errors.InvalidLevel
+            The level must be an :py:class:`int` between 1 and 5.
+        ~warnsystem.errors.BadArgument
+            You need to provide a valid :class:`discord.Member` object, except for a
+            hackban where a :class:`discord.User` works.
+        ~warnsystem.errors.NotFound
+            You provided an :py:class:`int` for a hackban, but the bot couldn't find
+            it by calling :func:`discord.Client.get_user_info`.
+        ~warnsystem.errors.MissingMuteRole
+            You're trying to mute someone but the mute role was not setup yet.
+            You can fix this by calling :func:`~warnsystem.api.API.maybe_create_mute_role`.
+        ~warnsystem.errors.LostPermissions
+            The bot lost a permission to do something (it had the perm before). This
+            can be lost permissions for sending messages to the modlog channel or
+            interacting with the mute role.
+        ~warnsystem.errors.MemberTooHigh
+            The bot is trying to take actions on someone but his top role is higher
+            than the bot's top role in the guild's hierarchy.
+        ~warnsystem.errors.NotAllowedByHierarchy
+            The moderator trying to warn someone is lower than him in the role hierarchy,
+            while the bot still has permissions to act. This is raised only if the
+            hierarchy check is enabled.
+        ~warnsystem.errors.MissingPermissions
+            The bot lacks a permissions to do something. Can be adding role, kicking
+            or banning members.
+        discord.errors.HTTPException
+            Unknown error from Discord API. It's recommanded to catch this
+            potential error too.
+        """
+        async with self._stats.measure("warn.checks"):
+            mod_channel, mute_role = await self._check_warn(guild, level)
+            member = await self._get_warned_user(member, level)
+            await self._check_member(guild, member, author, level)
+        template = None
+        if log_modlog or log_dm:
+            async with self._stats.measure("warn.template"):
+                template = await self._get_embed_template(guild, author, level, reason, time)
+        await self._warn_member(
+            guild,
+            member,
+            author,
+            level,
+            reason,
+            time,
+            log_modlog,
+            log_dm,
+            take_action,
+            mod_channel,
+            template,
+        )
 
         # all good!
         return True
 
-    async def _check_endwarn(self):
-        async def reinvite(guild, user, reason, duration):
-            channel = None
-            # find an ideal channel for the invite
-            # we get the one with the most members in the order of the guild
-            try:
-                channel = sorted(
-                    [
-                        x
-                        for x in guild.text_channels
-                        if x.permissions_for(guild.me).create_instant_invite
-                    ],
-                    key=lambda x: (x.position, len(x.members)),
-                )[0]
-            except IndexError:
+    @timed
+    async def warn_many(
+        self,
+        guild: discord.Guild,
+        members: list,
+        author: Union[discord.Member, str],
+        level: int,
+        reason: Optional[str] = None,
+        time: Optional[timedelta] = None,
+        log_modlog: bool = True,
+        log_dm: bool = True,
+        take_action: bool = True,
+        concurrency: int = 5,
+    ) -> dict:
+        """
+        Set the same warning on multiple members, useful against raids.
+
+        The settings and the permissions of the bot are checked once, then the members are
+        warned at the same time, with at most ``concurrency`` members at once.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild of the members to warn
+        members: list
+            A :py:class:`list` of :class:`discord.Member` or :py:class:`int`, like the
+            ``member`` argument of :func:`~warnsystem.api.API.warn`.
+        author: Union[discord.Member, str]
+            The member that called the action, which will be associated to the logs.
+        level: int
+            An :py:class:`int` between 1 and 5, the warning level.
+        reason: Optional[str]
+            The optional reason of the warnings.
+        time: Optional[timedelta]
+            The time before cancelling the action. This only works for a mute or a ban.
+        log_modlog: bool
+            Specify if an embed should be posted to the modlog channel. Default to :py:obj:`True`.
+        log_dm: bool
+            Specify if an embed should be sent to the warned users. Default to :py:obj:`True`.
+        take_action: bool
+            Specify if the bot should take action on the members. Default to :py:obj:`True`.
+        concurrency: int
+            The maximum number of members warned at the same time. Default to 5.
+
+        Returns
+        -------
+        dict
+            A :py:class:`dict` with the given members as keys, associated to :py:obj:`True` if
+            the warning succeeded, else the exception raised for this member. The possible
+            exceptions are the same as :func:`~warnsystem.api.API.warn`.
+
+        Raises
+        ------
+        ~warnsystem.errors.InvalidLevel
+            The level must be an :py:class:`int` between 1 and 5.
+        ~warnsystem.errors.NotFound
+            There is no modlog channel.
+        ~warnsystem.errors.MissingMuteRole
+            You're trying to mute members but the mute role was not setup yet.
+        ~warnsystem.errors.LostPermissions
+            The bot lost a permission to send messages in the modlog channel or to use the mute
+            role.
+        ~warnsystem.errors.MissingPermissions
+            The bot lacks a permissions to do the action.
+        """
+        mod_channel, mute_role = await self._check_warn(guild, level)
+        template = None
+        if log_modlog or log_dm:
+            template = await self._get_embed_template(guild, author, level, reason, time)
+        semaphore = asyncio.Semaphore(concurrency)
+        results = {}
+
+        async def warn_one(member):
+            async with semaphore:
+                try:
+                    user = await self._get_warned_user(member, level)
+                    await self._check_member(guild, user, author, level)
+                    await self._warn_member(
+                        guild,
+                        user,
+                        author,
+                        level,
+                        reason,
+                        time,
+                        log_modlog,
+                        log_dm,
+                        take_action,
+                        mod_channel,
+                        template,
+                    )
+                except Exception as e:
+                    results[member] = e
+                else:
+                    results[member] = True
+
+        await asyncio.gather(*[warn_one(x) for x in dict.fromkeys(members)])
+        return results
+
+    async def _reinvite(self, guild, member, reason, duration):
+        invite = self._take_invite(guild)
+        if not invite:
+            # the pool is empty, create one now
+            channel = self._get_invite_channel(guild)
+            if not channel:
                 # can't find a valid channel
                 log.info(
                     f"Can't find a channel where I can create an invite in guild {guild} "
                     f"(ID: {guild.id}) when reinviting {member} after its unban."
                 )
                 return
-
             try:
                 invite = await channel.create_invite(max_uses=1)
             except Exception as e:
+                self._invalidate_invite_channel(guild)
                 log.warn(
                     f"Couldn't create an invite for guild {guild} (ID: {guild.id} to reinvite "
                     f"{member} (ID: {member.id}) after its unban.",
                     exc_info=e,
                 )
-            else:
+                return
+        try:
+            await member.send(
+                _(
+                    "You were unbanned from {guild}, your temporary ban (reason: "
+                    "{reason}) just ended after {duration}.\nYou can join back using this "
+                    "invite: {invite}"
+                ).format(guild=guild.name, reason=reason, duration=duration, invite=invite)
+            )
+        except discord.errors.Forbidden:
+            # couldn't send message to the user, quite common
+            log.info(
+                f"Couldn't reinvite member {member} (ID: {member.id}) on guild "
+                f"{guild} (ID: {guild.id}) after its temporary ban."
+            )
+
+    async def _end_temporary_warn(self, guild: discord.Guild, action: dict):
+        """
+        End a temporary mute or ban. The action must be removed from the config after.
+
+        Returns :py:obj:`False` if the action can't be cancelled. Other errors are raised.
+        """
+        taken_on = action["time"]
+        author = guild.get_member(action["author"])
+        member = guild.get_member(action["member"])
+        case_reason = action["reason"]
+        level = action["level"]
+        action_str = _("mute") if level == 2 else _("ban")
+        if not member:
+            if level == 2:
+                # the member left, the role is already gone
+                return True
+            # the user is only needed for the reinvite, unbanning works with the ID
+            member = await self._get_user_info(action["member"])
+            if not member:
+                member = discord.Object(id=action["member"])
+
+        reason = _(
+            "End of timed {action} of {member} requested by {author} that lasted "
+            "for {time}. Reason of the {action}: {reason}"
+        ).format(
+            action=action_str,
+            member=member,
+            author=author if author else action["author"],
+            time=action["duration"],
+            reason=case_reason,
+        )
+        try:
+            if level == 2:
+                await self._unmute(member, reason=reason)
+            if level == 5:
+                await guild.unban(member, reason=reason)
+                reinvite = (await self._get_settings(guild))["reinvite"]
+                if reinvite and not isinstance(member, discord.Object):
+                    await self._reinvite(guild, member, case_reason, action["duration"])
+        except discord.errors.Forbidden:
+            log.warn(
+                f"I lost required permissions for ending the timed {action_str}. "
+                f"Member {member} (ID: {member.id}) from guild {guild} (ID: "
+                f"{guild.id}) will stay as it is now."
+            )
+            return False
+        except discord.errors.NotFound:
+            # already unbanned
+            pass
+        # other exceptions are raised, the end of the warn will be retried later
+        log.debug(
+            f"Ended timed {'mute' if level == 2 else 'ban'} of {member} (ID: "
+            f"{member.id}) taken on {taken_on} requested by {author} (ID: "
+            f"{action['author']}) that lasted for {action['duration']} on guild "
+            f'{guild} (ID: {guild.id} for the reason "{reason}"\nExpected end time '
+            f"of warn: {action['until']}"
+        )
+        return True
+
+    async def _end_guild_timers(self, guild: discord.Guild, timers: set):
+        """
+        End the temporary warns of a guild matching the ``(until, member_id)`` timers.
+
+        The warns are ended concurrently, limited for the guild and for all guilds. A warn that
+        couldn't be ended is scheduled again, the others are removed from the config at once.
+        """
+        semaphore = asyncio.Semaphore(EXPIRATION_GUILD_CONCURRENCY)
+
+        async def end(action: dict) -> bool:
+            until, member_id = action["until"], action["member"]
+            async with semaphore, self._expiration_semaphore:
                 try:
-                    await member.send(
-                        _(
-                            "You were unbanned from {guild}, your temporary ban (reason: "
-                            "{reason}) just ended after {duration}.\nYou can join back using this "
-                            "invite: {invite}"
-                        ).format(guild=guild.name, reason=reason, duration=duration, invite=invite)
+                    ended = await self._end_temporary_warn(guild, action)
+                except Exception as e:
+                    log.error(
+                        f"Couldn't end the timed warn of member {member_id} on guild {guild} "
+                        f"(ID: {guild.id}), it will be retried later.",
+                        exc_info=e,
                     )
-                except discord.errors.Forbidden:
-                    # couldn't send message to the user, quite common
-                    log.info(
-                        f"Couldn't reinvite member {member} (ID: {member.id}) on guild "
-                        f"{guild} (ID: {guild.id}) after its temporary ban."
+                    self._timer_stats["failed"] += 1
+                    self._retry_timer(until, guild.id, member_id)
+                    return False
+            self._timer_stats["completed" if ended else "failed"] += 1
+            return True
+
+        data = (await self._get_settings(guild))["temporary_warns"]
+        actions = [x for x in data if (x["until"], x["member"]) in timers]
+        results = await asyncio.gather(*[end(x) for x in actions])
+        removed = {(x["until"], x["member"]) for x, result in zip(actions, results) if result}
+        if not removed:
+            return
+        # read again, new warns could have been added in the meantime
+        async with self.data.guild(guild).temporary_warns() as warns:
+            warns[:] = [x for x in warns if (x["until"], x["member"]) not in removed]
+        self._invalidate_settings(guild)
+        for until, member_id in removed:
+            self._timer_attempts.pop((guild.id, member_id, until), None)
+
+    async def _check_endwarn(self):
+        """Pop the timers that ended from the heap and cancel their action in all guilds."""
+        now = int(datetime.now().timestamp())
+        ended = {}
+        while self._timers and self._timers[0][0] <= now:
+            due, guild_id, member_id, until = heapq.heappop(self._timers)
+            ended.setdefault(guild_id, set()).add((until, member_id))
+
+        async def end_guild(guild_id: int, timers: set):
+            guild = self.bot.get_guild(guild_id)
+            if guild:
+                try:
+                    return await self._end_guild_timers(guild, timers)
+                except Exception as e:
+                    log.error(
+                        f"Couldn't end the timed warns of guild {guild} (ID: {guild.id}), "
+                        "they will be retried later.",
+                        exc_info=e,
                     )
+            # guild unavailable, bot removed or error, try again later
+            for until, member_id in timers:
+                self._retry_timer(until, guild_id, member_id)
 
-        guilds = await self.data.all_guilds()
-        now = datetime.today()
+        await asyncio.gather(*[end_guild(x, y) for x, y in ended.items()])
 
-        for guild, data in guilds.items():
-            guild = self.bot.get_guild(guild)
-            if not guild:
+    async def _timer_loop(self):
+        """Sleep until the end of the next timer, then end the temporary warns."""
+        while True:
+            delay = None
+            if self._timers:
+                delay = self._timers[0][0] - datetime.now().timestamp()
+            if delay is None or delay > 0:
+                self._timers_event.clear()
+                try:
+                    await asyncio.wait_for(self._timers_event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
                 continue
-            data = data["temporary_warns"]
-            to_remove = []
-            for action in data:
-                taken_on = action["time"]
-                until = self._get_datetime(action["until"])
-                author = guild.get_member(action["author"])
-                member = guild.get_member(action["member"])
-                case_reason = action["reason"]
-                level = action["level"]
-                action_str = _("mute") if level == 2 else _("ban")
-                if not member:
-                    if level == 2:
-                        to_remove.append(action)
-                        continue
-                    member = await self._get_user_info(action["member"])
-
-                reason = _(
-                    "End of timed {action} of {member} requested by {author} that lasted "
-                    "for {time}. Reason of the {action}: {reason}"
-                ).format(
-                    action=action_str,
-                    member=member,
-                    author=author if author else action["author"],
-                    time=action["duration"],
-                    reason=case_reason,
-                )
-                if until < now:
-                    # end of warn
-                    try:
-                        if level == 2:
-                            await self._unmute(member, reason=reason)
-                        if level == 5:
-                            await guild.unban(member, reason=reason)
-                            if await self.data.guild(guild).reinvite():
-                                await reinvite(guild, member, case_reason, action["duration"])
-                    except discord.errors.Forbidden:
-                        log.warn(
-                            f"I lost required permissions for ending the timed {action_str}. "
-                            f"Member {member} (ID: {member.id}) from guild {guild} (ID: "
-                            f"{guild.id}) will stay as it is now."
-                        )
-                    except discord.errors.HTTPException as e:
-                        log.warn(
-                            f"Couldn't end the timed {action_str} of {member} (ID: "
-                            f"{member.id}) from guild {guild} (ID: {guild.id}). He will stay "
-                            "as it is now.",
-                            exc_info=e,
-                        )
-                    else:
-                        log.debug(
-                            f"Ended timed {'mute' if level == 2 else 'ban'} of {member} (ID: "
-                            f"{member.id}) taken on {taken_on} requested by {author} (ID: "
-                            f"{author.id}) that lasted for {action['duration']} on guild "
-                            f'{guild} (ID: {guild.id} for the reason "{reason}"\nCurrent time: '
-                            f"{now}\nExpected end time of warn: {until}"
-                        )
-                    to_remove.append(action)
-            for item in to_remove:
-                data.remove(item)
-            if to_remove:
-                await self.data.guild(guild).temporary_warns.set(data)
+            await self._check_endwarn()
 
     async def _loop_task(self):
         """
         This is an infinite loop task started with the cog that will check\
         if a temporary warn (mute or ban) is over, and cancel the action if it's true.
 
-        The loop runs every 10 seconds.
+        The loop sleeps until the end of the next timer, and is woken up if a new
+        timer ending sooner is started.
         """
         await self.bot.wait_until_ready()
         log.debug(
             "Starting infinite loop for unmutes and unbans. Canel the "
             'task with bot.get_cog("WarnSystem").task.cancel()'
         )
-        errors = 0
+        # not related to the timers, but the guilds are only available from now
+        self.bot.loop.create_task(self._fill_all_invite_pools())
+        crashes = 0
         while True:
+            started = datetime.now().timestamp()
             try:
-                await self._check_endwarn()
+                # the timers are loaded again after a crash, in case some of them were lost
+                await self._load_timers()
+                await self._timer_loop()
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                errors += 1
-                if errors >= 3:
-                    # more than 3 errors in our loop, let's shut down the loop
-                    log.critical(
-                        "The loop for unmutes and unbans encountered a third error. To prevent "
-                        "more damages, the loop will be cancelled. Timed mutes and bans no longer "
-                        "works for now. Reload the cog to start the loop back. If the problem "
-                        "persists, report the error and update the cog.",
-                        exc_info=e,
-                    )
-                    return
+                if datetime.now().timestamp() - started > TIMER_MAX_RETRY_DELAY:
+                    crashes = 0  # the loop worked for a while, this isn't the same problem
+                delay = min(TIMER_RETRY_DELAY * 2 ** crashes, TIMER_MAX_RETRY_DELAY)
+                crashes += 1
+                self._timer_stats["restarts"] += 1
                 log.error(
-                    "Error in loop for unmutes and unbans. The loop will be resumed.", exc_info=e
+                    "Error in loop for unmutes and unbans. The loop will be restarted in "
+                    f"{delay} seconds.",
+                    exc_info=e,
                 )
-            await asyncio.sleep(10)
+                await asyncio.sleep(delay)
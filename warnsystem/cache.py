@@ -0,0 +1,261 @@
+"""
+In-memory structures used by the API to avoid reading and parsing the whole config.
+
+Nothing here is persisted, everything is rebuilt from the config when needed.
+"""
+
+import re
+import time
+
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from heapq import merge
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Union
+
+__all__ = ["CaseIndex", "TTLCache", "tokenize"]
+
+WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text: Optional[str]) -> set:
+    """Return the set of lowercase words of a text, used for the reason search."""
+    return set(WORD_RE.findall(text.lower())) if text else set()
+
+
+class CaseIndex:
+    """
+    Index of all cases of a guild.
+
+    Each case is identified by a key ``(time, sequence)``, where ``time`` is the timestamp of
+    the case, and ``sequence`` a number unique to the index. Sorted lists of these keys are
+    kept for the whole guild, for each level and for each author, so we can get the cases in
+    a time range with a binary search.
+
+    Each case also has an ID, unique in the guild and never reused. The keys of each member
+    are kept in the order of their IDs, which is the order of creation, so a case can be found
+    with its ID or its position in the member's modlog.
+
+    An inverted index gives the keys of the cases containing each word of the reasons, so a
+    search only reads the cases of its rarest word.
+    """
+
+    def __init__(self):
+        self._sequence = 0
+        self.last_id = 0  # the highest case ID given, see next_id
+        self.cases = {}  # key: case, the case is a copy of the config with a "member" key
+        self.by_time = []
+        self.by_level = {}
+        self.by_author = {}
+        self.by_member = {}  # member ID: {key: None}, an ordered set
+        self.by_id = {}  # case ID: key
+        self.by_word = {}  # word: set of keys
+        self.archived = {}  # member ID: number of cases moved to the archive
+
+    def __len__(self):
+        return len(self.cases)
+
+    def next_id(self) -> int:
+        """Reserve the ID of a new case."""
+        self.last_id += 1
+        return self.last_id
+
+    def add(self, member_id: int, case: dict, time: float) -> tuple:
+        """Add a new case at the end of a member's modlog, and return its key."""
+        key = (time, self._sequence)
+        self._sequence += 1
+        case = dict(case, member=member_id)
+        self.cases[key] = case
+        insort(self.by_time, key)
+        insort(self.by_level.setdefault(case["level"], []), key)
+        insort(self.by_author.setdefault(case["author"], []), key)
+        self.by_member.setdefault(member_id, {})[key] = None
+        self.by_id[case["id"]] = key
+        self.last_id = max(self.last_id, case["id"])
+        self._index_words(key, case["reason"])
+        return key
+
+    def get(self, member_id: int, position: int) -> dict:
+        """Get the case of a member at the given position (starting at 0)."""
+        return self.cases[self._key_at(member_id, position)]
+
+    def get_by_id(self, case_id: int) -> dict:
+        """Get a case with its ID, or raise :class:`KeyError`."""
+        return self.cases[self.by_id[case_id]]
+
+    def remove(self, case_id: int) -> dict:
+        """Remove a case with its ID, or raise :class:`KeyError`."""
+        key = self.by_id.pop(case_id)
+        case = self.cases.pop(key)
+        keys = self.by_member[case["member"]]
+        del keys[key]
+        if not keys:
+            del self.by_member[case["member"]]
+        self._remove_key(self.by_time, key)
+        self._remove_key(self.by_level[case["level"]], key)
+        self._remove_key(self.by_author[case["author"]], key)
+        self._unindex_words(key, case["reason"])
+        return case
+
+    def set_reason(self, case_id: int, reason: str) -> dict:
+        """Edit the reason of a case with its ID, or raise :class:`KeyError`."""
+        key = self.by_id[case_id]
+        case = self.cases[key]
+        self._unindex_words(key, case["reason"])
+        case["reason"] = reason
+        self._index_words(key, reason)
+        return case
+
+    def _key_at(self, member_id: int, position: int) -> tuple:
+        if position < 0:
+            raise IndexError(position)
+        try:
+            return next(islice(self.by_member[member_id], position, None))
+        except StopIteration:
+            raise IndexError(position)
+
+    def _remove_key(self, keys: list, key: tuple):
+        del keys[bisect_left(keys, key)]
+
+    def _index_words(self, key: tuple, reason: Optional[str]):
+        for word in tokenize(reason):
+            self.by_word.setdefault(word, set()).add(key)
+
+    def _unindex_words(self, key: tuple, reason: Optional[str]):
+        for word in tokenize(reason):
+            keys = self.by_word[word]
+            keys.discard(key)
+            if not keys:
+                del self.by_word[word]
+
+    def search(self, query: str) -> list:
+        """
+        Return the keys of the cases containing all the words of the query in their reason,
+        sorted from the oldest to the newest.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        try:
+            sets = sorted((self.by_word[x] for x in words), key=len)
+        except KeyError:
+            return []  # one of the words is never used
+        return sorted(sets[0].intersection(*sets[1:]))
+
+    def iter_keys(
+        self,
+        member: Optional[int] = None,
+        author: Optional[Union[int, str]] = None,
+        levels: Optional[Iterable[int]] = None,
+        since: Optional[float] = None,
+    ) -> Iterator[tuple]:
+        """
+        Iterate over the keys of the cases matching the filters, sorted from the oldest to the
+        newest, starting at the time ``since``.
+
+        Unlike :meth:`select`, nothing is copied, so this must be consumed before the index
+        is modified.
+        """
+        if member is not None:
+            lists = [sorted(self.by_member.get(member, []))]
+        elif author is not None:
+            lists = [self.by_author.get(author, [])]
+        elif levels is not None:
+            lists = [self.by_level.get(x, []) for x in set(levels)]
+        else:
+            lists = [self.by_time]
+        iterators = [self._iter_from(x, since) for x in lists]
+        keys = iterators[0] if len(iterators) == 1 else merge(*iterators)
+        if levels is not None and (member is not None or author is not None):
+            levels = set(levels)
+            keys = (x for x in keys if self.cases[x]["level"] in levels)
+        if author is not None and member is not None:
+            keys = (x for x in keys if self.cases[x]["author"] == author)
+        return keys
+
+    def _iter_from(self, keys: list, since: Optional[float]) -> Iterator[tuple]:
+        start = bisect_left(keys, (since,)) if since is not None else 0
+        for i in range(start, len(keys)):
+            yield keys[i]
+
+    def select(
+        self,
+        member: Optional[int] = None,
+        level: Optional[int] = None,
+        author: Optional[Union[int, str]] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> list:
+        """
+        Return the keys of the cases matching the filters, sorted from the oldest to the newest.
+
+        The most selective list of keys is used, then sliced with the time range. The other
+        filters are only checked on the remaining keys.
+
+        The keys of a member are returned in the order of their IDs instead, so the position
+        of a case is kept.
+        """
+        if member is not None:
+            keys = list(self.by_member.get(member, ()))
+            if since is not None:
+                keys = [x for x in keys if x[0] >= since]
+            if until is not None:
+                keys = [x for x in keys if x[0] <= until]
+            since = until = None
+        elif level is not None:
+            keys = self.by_level.get(level, [])
+        elif author is not None:
+            keys = self.by_author.get(author, [])
+        else:
+            keys = self.by_time
+        start = bisect_left(keys, (since,)) if since is not None else 0
+        end = bisect_right(keys, (until, float("inf"))) if until is not None else len(keys)
+        keys = keys[start:end]
+        if member is not None and level is not None:
+            keys = [x for x in keys if self.cases[x]["level"] == level]
+        if author is not None and (member is not None or level is not None):
+            keys = [x for x in keys if self.cases[x]["author"] == author]
+        return keys
+
+
+class TTLCache:
+    """
+    A mapping keeping the ``maxsize`` last used items, each one expiring ``ttl`` seconds after
+    being set.
+
+    The number of hits and misses of :meth:`get` are counted.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key: (expiration, value), from the least recently used
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, count: bool = True):
+        """Return the value of a key, or raise :class:`KeyError` if it's missing or expired."""
+        try:
+            expiration, value = self._items[key]
+        except KeyError:
+            pass
+        else:
+            if expiration > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += count
+                return value
+            del self._items[key]
+        self.misses += count
+        raise KeyError(key)
+
+    def set(self, key, value):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._items.pop(key, (None, default))[1]
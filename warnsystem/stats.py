@@ -0,0 +1,209 @@
+"""
+Instrumentation of the API: latency of the calls and number of Config reads and writes.
+
+Nothing here is persisted, the statistics are reset when the cog is reloaded.
+"""
+
+import asyncio
+import functools
+import inspect
+import time
+
+from bisect import bisect_left
+
+__all__ = ["Histogram", "Stats", "ConfigProxy", "timed"]
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60, float("inf"))
+
+# asyncio.current_task was added in Python 3.7
+current_task = getattr(asyncio, "current_task", None) or asyncio.Task.current_task
+
+
+class Histogram:
+    """
+    Latencies sorted in fixed buckets. Percentiles are estimated with the upper bound of
+    their bucket.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, latency: float):
+        self.buckets[bisect_left(BUCKETS, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, percent: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = percent / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": {str(x): y for x, y in zip(BUCKETS, self.buckets) if y},
+        }
+
+
+class Stats:
+    """Latency histogram and Config operations of each instrumented call."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}  # name: Histogram
+        self.config_calls = {}  # name: {"reads": int, "writes": int}
+        self._counters = {}  # task: stack of the counters of the calls running in the task
+
+    def measure(self, name: str) -> "_Measure":
+        """
+        Return an async context manager measuring the latency of the block and counting the
+        Config operations made inside it, in the same task.
+
+        The operations are also added to the call containing this one, if any.
+        """
+        return _Measure(self, name)
+
+    def count(self, operation: str):
+        """Count a Config operation (``"reads"`` or ``"writes"``) for the current call."""
+        counters = self._counters.get(current_task())
+        if counters:
+            counters[-1][operation] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "started": self.started,
+            "calls": {
+                name: dict(histogram.to_dict(), **self.config_calls[name])
+                for name, histogram in self.histograms.items()
+            },
+        }
+
+
+class _Measure:
+    def __init__(self, stats: Stats, name: str):
+        self.stats = stats
+        self.name = name
+        self.counter = {"reads": 0, "writes": 0}
+
+    async def __aenter__(self):
+        self.task = current_task()
+        self.stats._counters.setdefault(self.task, []).append(self.counter)
+        self.start = time.perf_counter()
+
+    async def __aexit__(self, *args):
+        stats = self.stats
+        latency = time.perf_counter() - self.start
+        counters = stats._counters[self.task]
+        counters.pop()
+        if not counters:
+            del stats._counters[self.task]
+        stats.histograms.setdefault(self.name, Histogram()).record(latency)
+        total = stats.config_calls.setdefault(self.name, {"reads": 0, "writes": 0})
+        for key, value in self.counter.items():
+            total[key] += value
+            if counters:
+                counters[-1][key] += value
+
+
+def timed(function):
+    """
+    Decorator measuring an API method with :meth:`Stats.measure`, using its name.
+
+    An async generator is measured from the start to the end of the iteration.
+    """
+
+    if inspect.isasyncgenfunction(function):
+
+        @functools.wraps(function)
+        async def generator(self, *args, **kwargs):
+            async with self._stats.measure(function.__name__):
+                async for item in function(self, *args, **kwargs):
+                    yield item
+
+        return generator
+
+    @functools.wraps(function)
+    async def wrapper(self, *args, **kwargs):
+        async with self._stats.measure(function.__name__):
+            return await function(self, *args, **kwargs)
+
+    return wrapper
+
+
+class ConfigProxy:
+    """
+    Wraps a Config object, or any of its groups and values, and counts the reads and writes.
+
+    A value is read when it's awaited and written when it's set. When used as a context
+    manager, it counts as both.
+    """
+
+    READS = ("all", "all_guilds", "all_members", "get_raw")
+    WRITES = ("set", "set_raw", "clear", "clear_raw")
+
+    def __init__(self, obj, stats: Stats):
+        self._obj = obj
+        self._stats = stats
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+        if name in self.READS or name in self.WRITES:
+            operation = "reads" if name in self.READS else "writes"
+
+            @functools.wraps(attr)
+            async def counted(*args, **kwargs):
+                self._stats.count(operation)
+                return await attr(*args, **kwargs)
+
+            return counted
+        if not hasattr(attr, "__self__"):
+            # a group or a value
+            return ConfigProxy(attr, self._stats)
+
+        # a method giving a group, like guild() or custom()
+        @functools.wraps(attr)
+        def wrapped(*args, **kwargs):
+            return ConfigProxy(attr(*args, **kwargs), self._stats)
+
+        return wrapped
+
+    def __call__(self, *args, **kwargs):
+        return _CountedContext(self._obj(*args, **kwargs), self._stats)
+
+
+class _CountedContext:
+    """The object returned by calling a value, that can be awaited or used with async with."""
+
+    def __init__(self, context, stats: Stats):
+        self._context = context
+        self._stats = stats
+
+    def __await__(self):
+        self._stats.count("reads")
+        return self._context.__await__()
+
+    async def __aenter__(self):
+        self._stats.count("reads")
+        return await self._context.__aenter__()
+
+    async def __aexit__(self, *args):
+        self._stats.count("writes")
+        return await self._context.__aexit__(*args)
@@ -1,16 +1,23 @@
 # WarnSystem by retke, aka El Laggron
+import asyncio
+import csv
 import discord
+import gzip
+import io
+import json
 import logging
 import re
 import time
 
-from typing import Union, TYPE_CHECKING
+from typing import Union, Optional, Callable, TYPE_CHECKING
+from collections.abc import Sequence
 from asyncio import TimeoutError as AsyncTimeoutError
 from datetime import datetime, timedelta
 from pathlib import Path
-from json import loads
+from json import JSONDecoder, JSONDecodeError
 
 from redbot.core import commands, Config, checks
+from redbot.core.data_manager import cog_data_path
 from redbot.core.i18n import Translator, cog_i18n
 from redbot.core.utils import predicates, menus, mod
 from redbot.core.utils.chat_formatting import pagify
@@ -20,7 +27,7 @@ from redbot.core.utils.chat_formatting import pagify
 # creating this before importing other modules allows to import the translator
 _ = Translator("WarnSystem", __file__)
 
-from .api import API
+from .api import API, _only_ids
 from . import errors
 
 if TYPE_CHECKING:
@@ -73,6 +80,127 @@ def timedelta_converter(argument: str) -> timedelta:
     return timedelta(**params)
 
 
+def format_date(date: Optional[datetime], format: str = "%a %d %B %Y %H:%M:%S") -> str:
+    """Format a date of a case, which is None if it couldn't be converted from the old format."""
+    return date.strftime(format) if date is not None else _("unknown date")
+
+
+def iter_json_object(path: Path, chunk_size: int = 65536):
+    """
+    Yield the ``(key, value)`` pairs of the JSON object contained in a file.
+
+    The file is read by chunks and each value is decoded when it is complete, so the whole
+    file is never loaded in memory. This is blocking, run it in an executor.
+
+    Raises
+    ------
+    ValueError
+        The file doesn't contain a valid JSON object.
+    """
+    decoder = JSONDecoder()
+    whitespace = re.compile(r"\s*")
+    with path.open() as file:
+        buffer = ""
+        position = 0
+        eof = False
+
+        def read():
+            # remove what was already decoded and add a new chunk
+            nonlocal buffer, position, eof
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            return not eof
+
+        def next_char() -> str:
+            nonlocal position
+            while True:
+                position = whitespace.match(buffer, position).end()
+                if position < len(buffer):
+                    return buffer[position]
+                if not read():
+                    raise ValueError("Unexpected end of the file.")
+
+        def decode():
+            nonlocal position
+            next_char()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                except JSONDecodeError:
+                    if not read():
+                        raise
+                    continue
+                if end == len(buffer) and read():
+                    # a number could continue in the next chunk
+                    continue
+                position = end
+                return value
+
+        if next_char() != "{":
+            raise ValueError("The file doesn't contain a JSON object.")
+        position += 1
+        if next_char() == "}":
+            return
+        while True:
+            key = decode()
+            if not isinstance(key, str) or next_char() != ":":
+                raise ValueError(f"Invalid JSON object key at position {position}.")
+            position += 1
+            yield key, decode()
+            char = next_char()
+            position += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or '}}' at position {position}.")
+
+
+class CasePages(Sequence):
+    """
+    Pages of the warnings menu, only rendered when they are shown.
+
+    The first page is the summary, then each case has its page. The pages next to the
+    requested one are rendered at the same time, so scrolling doesn't wait.
+    """
+
+    def __init__(self, summary: discord.Embed, cases: list, render: Callable):
+        self.cases = cases
+        self.render = render  # function making the embed of a case from its index and content
+        self.pages = {0: summary}
+        self.placeholder = discord.Embed()
+
+    def __len__(self):
+        return len(self.cases) + 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page index out of range")
+        page = self._get_page(index)
+        for neighbour in (index - 1, index + 1):
+            if 0 < neighbour < len(self):
+                self._get_page(neighbour)
+        return page
+
+    def __iter__(self):
+        # Red's menu checks the type of all pages each time a page is shown
+        # the pages not rendered yet are replaced by an empty embed instead of rendering them
+        for i in range(len(self)):
+            yield self.pages.get(i, self.placeholder)
+
+    def _get_page(self, index: int) -> discord.Embed:
+        try:
+            return self.pages[index]
+        except KeyError:
+            page = self.pages[index] = self.render(index, self.cases[index - 1])
+            return page
+
+
 EMBED_MODLOG = lambda x: _("A member got a level {} warning.").format(x)
 EMBED_USER = lambda x: _("The moderation team set you a level {} warning.").format(x)
 
@@ -87,7 +215,10 @@ class WarnSystem(BaseCog):
     Full documentation and FAQ: http://laggron.red/warnsystem.html
     """
 
-    default_global = {"enable_sentry": None}
+    default_global = {
+        "enable_sentry": None,
+        "data_version": 0,  # format of the data, see API._update_data
+    }
     default_guild = {
         "delete_message": False,  # if the [p]warn commands should delete the context message
         "show_mod": False,  # if the responsible mod should be revealed to the warned user
@@ -138,8 +269,23 @@ class WarnSystem(BaseCog):
         },
         "url": None,  # URL set for the title of all embeds
         "temporary_warns": [],  # list of temporary warns (need to unmute/unban after some time)
+        "last_case_id": 0,  # the highest case ID given, IDs are never reused
+        "archive_after": None,  # number of days before a case is moved to the archive
+        "archive_horizon": None,  # timestamp, all archived cases are older than this
+        "mute_concurrency": 5,  # channels edited at the same time when creating the mute role
+    }
+    default_custom_member = {
+        "cases": {},  # case ID: case
+        "archived": 0,  # number of cases moved to the archive, they come before the others
+        "counters": {  # number of warnings, kept updated with the cases
+            "total": 0,
+            "1": 0,
+            "2": 0,
+            "3": 0,
+            "4": 0,
+            "5": 0,
+        },
     }
-    default_custom_member = {"x": []}  # cannot set a list as base group
 
     def __init__(self, bot):
         self.bot = bot
@@ -149,12 +295,23 @@ class WarnSystem(BaseCog):
         self.data.register_guild(**self.default_guild)
         self.data.register_custom("MODLOGS", **self.default_custom_member)
 
-        self.api = API(bot, self.data)
+        self.api = API(bot, self.data, archive_path=cog_data_path(self) / "archives")
         self.errors = errors
         self.sentry = None
         self.translator = _
 
-        self.task = bot.loop.create_task(self.api._loop_task())
+    def _start_tasks(self):
+        """
+        Start the loop tasks of the API. Called by setup once the config is updated, so the
+        loops never read data in an old format.
+        """
+        loop = self.bot.loop
+        self.task = loop.create_task(self.api._loop_task())
+        self.mute_task = loop.create_task(self.api._mute_drift_loop())
+        self.stats_task = loop.create_task(
+            self.api._dump_stats_loop(cog_data_path(self) / "stats.json")
+        )
+        self.archive_task = loop.create_task(self.api._archive_loop())
 
     __version__ = "1.0.4"
     __author__ = "retke (El Laggron)"
@@ -202,44 +359,44 @@ class WarnSystem(BaseCog):
             return
         try:
             await self.api.warn(ctx.guild, member, ctx.author, level, reason, time)
-        except errors.MissingPermissions as e:
-            await ctx.send(e)
-        except errors.MemberTooHigh as e:
-            await ctx.send(e)
-        except errors.LostPermissions as e:
-            await ctx.send(e)
-        except errors.MissingMuteRole:
-            await ctx.send(
-                _(
-                    "You need to set up the mute role before doing this.\n"
-                    "Use the `[p]warnset mute` command for this."
-                )
+        except (
+            errors.MissingPermissions,
+            errors.MemberTooHigh,
+            errors.LostPermissions,
+            errors.MissingMuteRole,
+            errors.NotFound,
+            errors.NotAllowedByHierarchy,
+        ) as e:
+            await ctx.send(await self._format_warn_error(ctx, e, member))
+        if (await self.api._get_settings(ctx.guild))["delete_message"]:
+            await ctx.message.delete()
+
+    async def _format_warn_error(self, ctx, error: Exception, member=None) -> str:
+        """Get the message explaining why a warning failed."""
+        if isinstance(error, errors.MissingMuteRole):
+            return _(
+                "You need to set up the mute role before doing this.\n"
+                "Use the `[p]warnset mute` command for this."
             )
-        except errors.NotFound:
-            await ctx.send(
-                _(
-                    "Please set up a modlog channel before warning a member.\n\n"
-                    "**With WarnSystem**\n"
-                    "*Use the `[p]warnset channel` command.*\n\n"
-                    "**With Red Modlog**\n"
-                    "*Load the `modlogs` cog and use the `[p]modlogset modlog` command.*"
-                )
+        if isinstance(error, errors.NotFound):
+            return _(
+                "Please set up a modlog channel before warning a member.\n\n"
+                "**With WarnSystem**\n"
+                "*Use the `[p]warnset channel` command.*\n\n"
+                "**With Red Modlog**\n"
+                "*Load the `modlogs` cog and use the `[p]modlogset modlog` command.*"
             )
-        except errors.NotAllowedByHierarchy:
-            is_admin = mod.is_admin_or_superior(self.bot, member)
-            await ctx.send(
-                _(
-                    "You are not allowed to do this, {member} is higher than you in the role "
-                    "hierarchy. You can only warn members which top role is lower than yours.\n\n"
-                ).format(member=str(member))
-                + (
-                    _("You can disable this check by using the `[p]warnset hierarchy` command.")
-                    if is_admin
-                    else ""
-                )
+        if isinstance(error, errors.NotAllowedByHierarchy):
+            is_admin = await mod.is_admin_or_superior(self.bot, ctx.author)
+            return _(
+                "You are not allowed to do this, {member} is higher than you in the role "
+                "hierarchy. You can only warn members which top role is lower than yours.\n\n"
+            ).format(member=str(member)) + (
+                _("You can disable this check by using the `[p]warnset hierarchy` command.")
+                if is_admin
+                else ""
             )
-        if await self.data.guild(ctx.guild).delete_message():
-            await ctx.message.delete()
+        return str(error)
 
     # all settings
     @commands.group()
@@ -267,7 +424,7 @@ class WarnSystem(BaseCog):
         async with ctx.typing():
 
             # collect data and make strings
-            all_data = await self.data.guild(guild).all()
+            all_data = await self.api._get_settings(guild)
             modlog_channels = await self.api.get_modlog_channel(guild, "all")
             channels = ""
             for key, channel in dict(modlog_channels).items():
@@ -288,6 +445,11 @@ class WarnSystem(BaseCog):
             mute_role = _("No mute role set.") if not mute_role else mute_role.name
             hierarchy = _("Enabled") if all_data["respect_hierarchy"] else _("Disabled")
             reinvite = _("Enabled") if all_data["reinvite"] else _("Disabled")
+            archive = (
+                _("After {days} days").format(days=all_data["archive_after"])
+                if all_data["archive_after"]
+                else _("Disabled")
+            )
             bandays = _("Softban: {softban}\nBan: {ban}").format(
                 softban=all_data["bandays"]["softban"], ban=all_data["bandays"]["ban"]
             )
@@ -335,6 +497,7 @@ class WarnSystem(BaseCog):
             embed.add_field(name=_("Respect hierarchy"), value=hierarchy)
             embed.add_field(name=_("Reinvite unbanned members"), value=reinvite)
             embed.add_field(name=_("Days of messages to delete"), value=bandays)
+            embed.add_field(name=_("Archive warnings"), value=archive)
             embed.add_field(name=_("Substitutions"), value=substitutions)
             embed.add_field(
                 name=_("Modlog embed descriptions"), value=modlog_descriptions, inline=False
@@ -378,6 +541,7 @@ class WarnSystem(BaseCog):
         else:
             if not level:
                 await self.data.guild(guild).channels.main.set(channel.id)
+                self.api._invalidate_settings(guild)
                 await ctx.send(
                     _(
                         "Done. All events will be send to that channel by default.\n\nIf you want "
@@ -395,6 +559,7 @@ class WarnSystem(BaseCog):
                 )
             else:
                 await self.data.guild(guild).channels.set_raw(level, value=channel.id)
+                self.api._invalidate_settings(guild)
                 await ctx.send(
                     _(
                         "Done. All level {level} warnings events will be sent to that channel."
@@ -417,32 +582,57 @@ class WarnSystem(BaseCog):
                     _("I can't manage roles, please give me this permission to continue.")
                 )
                 return
+            progress = {"done": 0, "total": 0}
+
+            def update(done: int, total: int):
+                progress.update(done=done, total=total)
+
+            message = None
+            task = self.bot.loop.create_task(
+                self.api.maybe_create_mute_role(
+                    guild,
+                    concurrency=(await self.api._get_settings(guild))["mute_concurrency"],
+                    progress=update,
+                )
+            )
             async with ctx.typing():
-                fails = await self.api.maybe_create_mute_role(guild)
-                my_position = guild.me.top_role.position
-                if fails is False:
-                    await ctx.send(
-                        _(
-                            "A mute role was already created! You can change it by specifying "
-                            "a role when typing the command.\n`[p]warnset mute <role name>`"
-                        )
+                while not task.done():
+                    await asyncio.wait([task], timeout=3)
+                    if task.done() or not progress["total"]:
+                        continue
+                    content = _("Editing the channel permissions... ({done}/{total})").format(
+                        **progress
                     )
-                    return
-                else:
-                    if fails:
-                        errors = _(
-                            "\n\nSome errors occured when editing the channel permissions:\n"
-                        ) + "\n".join(fails)
+                    if message:
+                        await message.edit(content=content)
                     else:
-                        errors = ""
-                    await ctx.send(
-                        _(
-                            "The role `Muted` was successfully created at position {pos}. Feel "
-                            "free to drag it in the hierarchy and edit its permissions, as long "
-                            "as my top role is above and the members to mute are below."
-                        ).format(pos=my_position - 1)
-                        + errors
+                        message = await ctx.send(content)
+            fails = task.result()
+            my_position = guild.me.top_role.position
+            if fails is False:
+                await ctx.send(
+                    _(
+                        "A mute role was already created! You can change it by specifying "
+                        "a role when typing the command.\n`[p]warnset mute <role name>`"
                     )
+                )
+                return
+            else:
+                if fails:
+                    errors = _(
+                        "\n\nSome errors occured when editing the channel permissions:\n"
+                    ) + "\n".join(fails)
+                else:
+                    errors = ""
+                for page in pagify(
+                    _(
+                        "The role `Muted` was successfully created at position {pos}. Feel "
+                        "free to drag it in the hierarchy and edit its permissions, as long "
+                        "as my top role is above and the members to mute are below."
+                    ).format(pos=my_position - 1)
+                    + errors
+                ):
+                    await ctx.send(page)
         elif role.position >= my_position:
             await ctx.send(
                 _(
@@ -452,6 +642,7 @@ class WarnSystem(BaseCog):
             )
         else:
             await self.data.guild(guild).mute_role.set(role.id)
+            self.api._invalidate_settings(guild)
             await ctx.send(_("The new mute role was successfully set!"))
 
     @warnset.command(name="hierarchy")
@@ -479,6 +670,7 @@ class WarnSystem(BaseCog):
             )
         elif enable:
             await self.data.guild(guild).respect_hierarchy.set(True)
+            self.api._invalidate_settings(guild)
             await ctx.send(
                 _(
                     "Done. Moderators will not be able to take actions on the members higher "
@@ -487,6 +679,7 @@ class WarnSystem(BaseCog):
             )
         else:
             await self.data.guild(guild).respect_hierarchy.set(False)
+            self.api._invalidate_settings(guild)
             await ctx.send(
                 _(
                     "Done. Moderators will be able to take actions on anyone on the server, as "
@@ -515,6 +708,8 @@ class WarnSystem(BaseCog):
             )
         elif enable:
             await self.data.guild(guild).reinvite.set(True)
+            self.api._invalidate_settings(guild)
+            self.api._refill_invites(guild)
             await ctx.send(
                 _(
                     "Done. The bot will try to send an invite to unbanned members. Please note "
@@ -524,8 +719,37 @@ class WarnSystem(BaseCog):
             )
         else:
             await self.data.guild(guild).reinvite.set(False)
+            self.api._invalidate_settings(guild)
             await ctx.send(_("Done. The bot will no longer reinvite unbanned members."))
 
+    @warnset.command(name="muteconcurrency")
+    async def warnset_muteconcurrency(self, ctx: commands.Context, number: int = None):
+        """
+        Set the number of channels edited at the same time when creating the mute role.
+
+        A higher number creates the mute role faster on servers with a lot of channels, but\
+        the bot will reach Discord's rate limits sooner. The default value is 5.
+
+        Invoke the command without arguments to get the current value.
+        """
+        guild = ctx.guild
+        if number is None:
+            current = await self.data.guild(guild).mute_concurrency()
+            await ctx.send(
+                _(
+                    "{number} channels are edited at the same time when creating the mute "
+                    "role. If you want to change this, type `[p]warnset muteconcurrency "
+                    "<number>`."
+                ).format(number=current)
+            )
+            return
+        if not 1 <= number <= 20:
+            await ctx.send(_("The number must be between 1 and 20."))
+            return
+        await self.data.guild(guild).mute_concurrency.set(number)
+        self.api._invalidate_settings(guild)
+        await ctx.send(_("The new value was successfully set!"))
+
     @warnset.command("bandays")
     async def warnset_bandays(self, ctx: commands.Context, ban_type: str, days: int):
         """
@@ -577,8 +801,10 @@ class WarnSystem(BaseCog):
             return
         if ban_type == "softban":
             await self.data.guild(guild).bandays.softban.set(days)
+            self.api._invalidate_settings(guild)
         else:
             await self.data.guild(guild).bandays.ban.set(days)
+            self.api._invalidate_settings(guild)
         await ctx.send(_("The new value was successfully set!"))
 
     @warnset.group(name="substitutions")
@@ -622,6 +848,7 @@ class WarnSystem(BaseCog):
                 await ctx.send(_("That substitution is too long! Maximum is 600 characters!"))
                 return
             substitutions[name] = text
+        self.api._invalidate_settings(ctx.guild)
         await ctx.send(
             _(
                 "Your new subsitutions with the keyword `{keyword}` was successfully "
@@ -649,6 +876,7 @@ class WarnSystem(BaseCog):
                 )
                 return
             del substitutions[name]
+        self.api._invalidate_settings(ctx.guild)
         await ctx.send(_("The substitutions was successfully deleted."))
 
     @warnset_substitutions.command(name="list")
@@ -698,6 +926,7 @@ class WarnSystem(BaseCog):
             )
         elif enable:
             await self.data.guild(guild).show_mod.set(True)
+            self.api._invalidate_settings(guild)
             await ctx.send(
                 _(
                     "Done. The moderator responsible of a warn will now be shown to the warned "
@@ -706,6 +935,7 @@ class WarnSystem(BaseCog):
             )
         else:
             await self.data.guild(guild).show_mod.set(False)
+            self.api._invalidate_settings(guild)
             await ctx.send(_("Done. The bot will no longer show the responsible moderator."))
 
     @warnset.command(name="description")
@@ -759,12 +989,120 @@ class WarnSystem(BaseCog):
         await self.data.guild(guild).set_raw(
             "embed_description_" + destination, str(level), value=description
         )
+        self.api._invalidate_settings(guild)
+        if "{invite}" in description:
+            self.api._refill_invites(guild)
         await ctx.send(
             _("The new description for {destination} (warn {level}) was successfully set!").format(
                 destination=_("modlog") if destination == "modlog" else _("user"), level=level
             )
         )
 
+    @warnset.command(name="archive")
+    async def warnset_archive(self, ctx: commands.Context, days: int = None):
+        """
+        Move the old warnings to an archive.
+
+        The warnings older than the given number of days are moved to a compressed file once a\
+        day. They are still shown with `[p]warnings` and counted, but the bot stays fast on\
+        servers with a lot of warnings.
+        Set 0 to stop archiving, the warnings already archived stay in the archive.
+
+        Invoke the command without arguments to get the current status.
+        """
+        guild = ctx.guild
+        current = await self.data.guild(guild).archive_after()
+        if days is None:
+            if current:
+                await ctx.send(
+                    _(
+                        "The warnings older than {days} days are archived. If you want to "
+                        "change this, type `[p]warnset archive <days>`, or `[p]warnset "
+                        "archive 0` to disable it."
+                    ).format(days=current)
+                )
+            else:
+                await ctx.send(
+                    _(
+                        "The warnings are not archived. If you want to archive the warnings "
+                        "older than a number of days, type `[p]warnset archive <days>`."
+                    )
+                )
+            return
+        if days < 0:
+            await ctx.send(_("The number of days must be positive."))
+            return
+        if days == 0:
+            await self.data.guild(guild).archive_after.set(None)
+            self.api._invalidate_settings(guild)
+            await ctx.send(
+                _(
+                    "Done. The warnings will not be archived anymore. The warnings already "
+                    "archived are kept in the archive."
+                )
+            )
+            return
+        await self.data.guild(guild).archive_after.set(days)
+        self.api._invalidate_settings(guild)
+        async with ctx.typing():
+            total = await self.api._archive_cases(guild, days)
+        await ctx.send(
+            _(
+                "Done. {number} warnings were archived. The warnings older than {days} days "
+                "will be archived every day."
+            ).format(number=total, days=days)
+        )
+
+    @warnset.command(name="export")
+    async def warnset_export(self, ctx: commands.Context, file_format: str = "jsonl"):
+        """
+        Export all the cases of the server to a file.
+
+        The file is compressed with gzip and saved in the data path of the cog.
+
+        `file_format` can be `jsonl` (one JSON object per line, default) or `csv`.
+        """
+        guild = ctx.guild
+        file_format = file_format.lower()
+        if file_format not in ("jsonl", "csv"):
+            await ctx.send(_("The format must be `jsonl` or `csv`."))
+            return
+        fields = ["id", "member", "level", "author", "reason", "time", "duration", "until"]
+        directory = cog_data_path(self) / "exports"
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{guild.id}-{int(time.time())}.{file_format}.gz"
+
+        def write(file, chunk: list):
+            # serializing and compressing is blocking, this is run in an executor
+            buffer = io.StringIO()
+            if file_format == "csv":
+                csv.DictWriter(buffer, fields, extrasaction="ignore").writerows(chunk)
+            else:
+                for case in chunk:
+                    buffer.write(json.dumps(case) + "\n")
+            file.write(buffer.getvalue())
+
+        total = 0
+        t1 = time.time()
+        file = await self.bot.loop.run_in_executor(None, gzip.open, path, "wt")
+        try:
+            if file_format == "csv":
+                await self.bot.loop.run_in_executor(None, file.write, ",".join(fields) + "\n")
+            async for chunk in self.api.export_cases(guild):
+                await self.bot.loop.run_in_executor(None, write, file, chunk)
+                total += len(chunk)
+        finally:
+            await self.bot.loop.run_in_executor(None, file.close)
+        await ctx.send(
+            _("Done! {number} cases were exported in {time} seconds to `{path}`.").format(
+                number=total, time=round(time.time() - t1, 2), path=path
+            )
+        )
+        log.info(
+            f"{ctx.author.name} (ID: {ctx.author.id}) exported {total} cases of the guild "
+            f"{guild} (ID: {guild.id}) to {path}"
+        )
+
     @warnset.command(name="convert")
     async def warnset_convert(self, ctx: commands.Context, *, path: Path):
         """
@@ -786,35 +1124,34 @@ class WarnSystem(BaseCog):
             except Exception:
                 pass
 
-        async def convert(data: dict) -> int:
+        def convert(progress: dict) -> dict:
             """
-            Convert V2 logs to V3 format.
+            Convert V2 logs to V3 format, reading the file progressively. This is blocking.
             """
-            try:
-                del data["version"]
-            except KeyError:
-                pass
-            total_cases = 0
-            for member, logs in data.items():
+            modlogs = {}
+            for member, logs in iter_json_object(path):
+                if member == "version":
+                    continue
                 cases = []
                 for case in [y for x, y in logs.items() if x.startswith("case")]:
                     level = {"Simple": 1, "Kick": 3, "Softban": 4, "Ban": 5}.get(case["level"], 1)
-                    timestamp = datetime.strptime(case["timestamp"], "%d %b %Y %H:%M").strftime(
-                        "%a %d %B %Y %H:%M:%S"
+                    timestamp = int(
+                        datetime.strptime(case["timestamp"], "%d %b %Y %H:%M").timestamp()
                     )
                     cases.append(
                         {
                             "level": level,
                             "author": "Unknown",
                             "reason": case["reason"],
-                            "time": timestamp,  # only day of the week missing
+                            "time": timestamp,
                             "duration": None,
+                            "until": None,
                         }
                     )
-                    total_cases += 1
-                async with self.data.custom("MODLOGS", guild.id, int(member)).x() as logs:
-                    logs.extend(cases)
-            return total_cases
+                modlogs[str(int(member))] = cases
+                progress["members"] += 1
+                progress["cases"] += len(cases)
+            return modlogs
 
         guild = ctx.guild
         react = guild.me.guild_permissions.add_reactions
@@ -855,21 +1192,6 @@ class WarnSystem(BaseCog):
             if not pred.result:
                 await ctx.send(_("Alrght, try again with the good file."))
                 return
-        content = path.open().read()
-        try:
-            content = loads(content)
-        except Exception as e:
-            log.warn(
-                f"Couldn't decode JSON given by {ctx.author} (ID: {ctx.author.id}) at {str(path)}",
-                exc_info=e,
-            )
-            await ctx.send(
-                _(
-                    "Couln't read the file because of an exception. "
-                    "Check your console or logs for details."
-                )
-            )
-            return
         await ctx.send(
             _(
                 "Would you like to **append** the logs or **overwrite** them?\n\n"
@@ -887,20 +1209,66 @@ class WarnSystem(BaseCog):
             await ctx.send(_("Request timed out."))
             return
         t1 = time.time()
-        if pred.result == 0:
-            await ctx.send(_("Starting conversion... This might take a long time."))
-            total = await convert(content)
-        elif pred.result == 1:
-            await ctx.send(_("Deleting server logs... Settings, such as channels, are kept."))
-            await self.data.custom("MODLOGS").set({})
-            await ctx.send(_("Starting conversion... This might take a long time."))
-            total = await convert(content)
+        progress = {"members": 0, "cases": 0}
+        message = await ctx.send(_("Starting conversion... This might take a long time."))
+        task = self.bot.loop.run_in_executor(None, convert, progress)
+        while not task.done():
+            await asyncio.wait([task], timeout=5)
+            if task.done():
+                break
+            elapsed = time.time() - t1
+            await message.edit(
+                content=_(
+                    "Converting... {cases} cases of {members} members read "
+                    "({speed} cases per second)."
+                ).format(
+                    cases=progress["cases"],
+                    members=progress["members"],
+                    speed=round(progress["cases"] / elapsed),
+                )
+            )
+        try:
+            content = task.result()
+        except Exception as e:
+            log.warn(
+                f"Couldn't decode JSON given by {ctx.author} (ID: {ctx.author.id}) at {str(path)}",
+                exc_info=e,
+            )
+            await ctx.send(
+                _(
+                    "Couln't read the file because of an exception. "
+                    "Check your console or logs for details."
+                )
+            )
+            return
+        index = await self.api._get_case_index(guild)
+        async with self.api._get_modlog_lock(guild):
+            if pred.result == 0:
+                modlogs = _only_ids(await self.data.custom("MODLOGS", guild.id).all())
+            else:
+                # overwrite, only the logs of this server are replaced
+                modlogs = {}
+                await self.api._clear_archive(guild)
+            for member, cases in content.items():
+                logs = modlogs.setdefault(member, {}).setdefault("cases", {})
+                for case in cases:
+                    case["id"] = index.next_id()
+                    logs[str(case["id"])] = case
+                # added to the existing counters, which also count the archived cases
+                counters = self.api._count_cases(cases)
+                for key, value in modlogs[member].get("counters", {}).items():
+                    counters[key] += value
+                modlogs[member]["counters"] = counters
+            await self.data.custom("MODLOGS", guild.id).set(modlogs)
+            await self.data.guild(guild).last_case_id.set(index.last_id)
+            self.api._invalidate_case_index(guild)
+        total = progress["cases"]
         t2 = time.time()
         await ctx.send(
             _(
                 "Done! {number} cases were added to the WarnSystem V3 log.\n"
-                "This took {time} seconds."
-            ).format(number=total, time=round(t2 - t1, 2))
+                "This took {time} seconds ({speed} cases per second)."
+            ).format(number=total, time=round(t2 - t1, 2), speed=round(total / max(t2 - t1, 0.01)))
         )
         log.info(
             f"{ctx.author.name} (ID: {ctx.author.id}) used the BetterMod data converter and "
@@ -1053,7 +1421,85 @@ class WarnSystem(BaseCog):
                 pass
         await ctx.send("Done.")
 
-    @commands.command()
+    @warn.command(name="bulk", aliases=["mass"], usage="<level> <members...> [time] [reason]")
+    async def warn_bulk(
+        self,
+        ctx: commands.Context,
+        level: int,
+        members: commands.Greedy[Union[discord.Member, int]],
+        *,
+        reason: str = None,
+    ):
+        """
+        Warn multiple members at once.
+
+        This is made for raids. The settings and my permissions are checked once, then all\
+        members are warned at the same time. A report is sent at the end.
+
+        You can give user IDs to ban users that are not in the server, and set a duration for\
+        mutes and bans, like with a single warning.
+
+        Examples:
+        - `[p]warn bulk 5 @raider1 @raider2 012345678987654321 Raid`
+        - `[p]warn bulk 2 @spammer1 @spammer2 1h Spam`
+        """
+        if not members:
+            await ctx.send_help()
+            return
+        time = None
+        if reason and (level == 2 or level == 5):
+            potential_time = reason.split()[0]
+            try:
+                time = timedelta_converter(potential_time)
+            except RedBadArgument:
+                pass
+            else:
+                if len(reason.split()) <= 1:
+                    reason = None
+                else:
+                    reason = " ".join(reason.split()[1:])  # removes time from string
+        reason = await self.api.format_reason(ctx.guild, reason)
+        if reason and len(reason) > 1024:  # embed limits
+            await ctx.send(_("The reason is too long for an embed."))
+            return
+        async with ctx.typing():
+            try:
+                results = await self.api.warn_many(
+                    ctx.guild, members, ctx.author, level, reason, time
+                )
+            except errors.InvalidLevel:
+                await ctx.send(_("The level must be a number between 1 and 5."))
+                return
+            except (
+                errors.MissingPermissions,
+                errors.LostPermissions,
+                errors.MissingMuteRole,
+                errors.NotFound,
+            ) as e:
+                await ctx.send(await self._format_warn_error(ctx, e))
+                return
+        fails = []
+        for member, result in results.items():
+            if result is True:
+                continue
+            if isinstance(result, errors.NotAllowedByHierarchy):
+                result = _("Higher than you in the role hierarchy.")
+            elif isinstance(result, errors.BadArgument):
+                result = _("Not in the server, user IDs can only be used for bans.")
+            elif not str(result):
+                result = result.__class__.__name__
+            fails.append(f"{member}: {result}")
+        text = _("{number} out of {total} members were successfully warned.").format(
+            number=len(results) - len(fails), total=len(results)
+        )
+        if fails:
+            text += _("\n\nThe following members couldn't be warned:\n") + "\n".join(fails)
+        for page in pagify(text):
+            await ctx.send(page)
+        if (await self.api._get_settings(ctx.guild))["delete_message"]:
+            await ctx.message.delete()
+
+    @commands.group(invoke_without_command=True)
     @commands.guild_only()
     @commands.bot_has_permissions(add_reactions=True, manage_messages=True)
     @commands.cooldown(1, 3, commands.BucketType.member)
@@ -1085,7 +1531,8 @@ class WarnSystem(BaseCog):
             await ctx.send(_("That case doesn't exist."))
             return
 
-        total = lambda level: len([x for x in cases if x["level"] == level])
+        counters = await self.api._get_counters(ctx.guild, user)
+        total = lambda level: counters.get(str(level), 0)
         warning_str = lambda level, plural: {
             1: (_("Warning"), _("Warnings")),
             2: (_("Mute"), _("Mutes")),
@@ -1094,7 +1541,6 @@ class WarnSystem(BaseCog):
             5: (_("Ban"), _("Bans")),
         }.get(level, _("unknown"))[1 if plural else 0]
 
-        embeds = []
         msg = []
         for i in range(6):
             total_warns = total(i)
@@ -1103,17 +1549,24 @@ class WarnSystem(BaseCog):
         warn_field = "\n".join(msg) if len(msg) > 1 else msg[0]
         embed = discord.Embed(description=_("User modlog summary."))
         embed.set_author(name=f"{user} | {user.id}", icon_url=user.avatar_url)
-        embed.add_field(name=_("Total number of warnings: ") + str(len(cases)), value=warn_field)
+        embed.add_field(
+            name=_("Total number of warnings: ") + str(counters["total"]), value=warn_field
+        )
         embed.set_footer(text=_("Click on the reactions to scroll through the warnings"))
-        embeds.append(embed)
+        colors = (await self.api._get_settings(ctx.guild))["colors"]
 
-        for i, case in enumerate(cases):
+        def render(number: int, case: dict) -> discord.Embed:
             level = case["level"]
-            moderator = ctx.guild.get_member(case["author"])
-            moderator = "ID: " + str(case["author"]) if not moderator else moderator.mention
+            moderator = case["author"]
+            if isinstance(moderator, discord.Member):
+                moderator = moderator.mention
+            else:
+                moderator = "ID: " + str(moderator)
 
             embed = discord.Embed(
-                description=_("Case #{number} informations").format(number=i + 1)
+                description=_("Case #{number} informations").format(number=number)
+                + "\n"
+                + _("Case ID: {id}").format(id=case["id"])
             )
             embed.set_author(name=f"{user} | {user.id}", icon_url=user.avatar_url)
             embed.add_field(
@@ -1124,14 +1577,17 @@ class WarnSystem(BaseCog):
                 embed.add_field(
                     name=_("Duration"),
                     value=_("{duration}\n(Until {date})").format(
-                        duration=case["duration"], date=case["until"]
+                        duration=case["duration"], date=format_date(case["until"])
                     ),
                 )
             embed.add_field(name=_("Reason"), value=case["reason"], inline=False),
-            embed.set_footer(text=_("The action was taken on {date}").format(date=case["time"]))
-            embed.color = await self.data.guild(ctx.guild).colors.get_raw(level)
+            embed.set_footer(
+                text=_("The action was taken on {date}").format(date=format_date(case["time"]))
+            )
+            embed.color = colors[str(level)]
+            return embed
 
-            embeds.append(embed)
+        embeds = CasePages(embed, cases, render)
 
         controls = {"⬅": menus.prev_page, "❌": menus.close_menu, "➡": menus.next_page}
         if await mod.is_mod_or_superior(self.bot, ctx.author) and user != ctx.author:
@@ -1141,6 +1597,42 @@ class WarnSystem(BaseCog):
             ctx=ctx, pages=embeds, controls=controls, message=None, page=index, timeout=60
         )
 
+    @warnings.command(name="search")
+    @checks.mod_or_permissions(administrator=True)
+    async def warnings_search(
+        self, ctx: commands.Context, level: Optional[int] = None, *, query: str
+    ):
+        """
+        Search the warnings of the server by their reason.
+
+        All the warnings with a reason containing all the given words are shown.
+        You can give a level before the words to only search in these warnings.
+
+        Example: `[p]warnings search 3 scam link`
+        """
+        cases = await self.api.search_cases(ctx.guild, query, level=level)
+        if not cases:
+            await ctx.send(_("No warning found."))
+            return
+        text = ""
+        for case in reversed(cases):  # newest first
+            member = case["member"] or _("Unknown user")
+            text += _("+ {member} | Level {level} | {date}\n{reason}\n\n").format(
+                member=member,
+                level=case["level"],
+                date=format_date(case["time"], "%a %d %B %Y %H:%M"),
+                reason=case["reason"],
+            )
+        messages = list(pagify(text, delims=["\n\n"], page_length=1800))
+        total_pages = len(messages)
+        pages = [
+            _("{number} warnings found:").format(number=len(cases))
+            + f"\n```diff\n{page}\n```"
+            + _("Page {page}/{max}").format(page=i + 1, max=total_pages)
+            for i, page in enumerate(messages)
+        ]
+        await menus.menu(ctx, pages, menus.DEFAULT_CONTROLS, timeout=60)
+
     async def _edit_case(
         self,
         ctx: commands.Context,
@@ -1163,15 +1655,17 @@ class WarnSystem(BaseCog):
             )
         await message.clear_reactions()
         embed = message.embeds[0]
-        member = await self.api._get_user_info(
-            int(embed.author.name.rpartition("|")[2].replace(" ", ""))
-        )
         embed.clear_fields()
         embed.description = _(
             "Case #{number} edition.\n\n**Please type the new reason to set**"
         ).format(number=page)
         embed.set_footer(text=_("You have two minutes to type your text in the chat."))
-        case = (await self.data.custom("MODLOGS", guild.id, member.id).x())[page - 1]
+        # the case shown on the page, its position may have changed since it was rendered
+        try:
+            case = await self.api.get_case_by_id(guild, pages.cases[page - 1]["id"])
+        except errors.NotFound:
+            await message.edit(content=_("That case doesn't exist anymore."), embed=None)
+            return
         await message.edit(embed=embed)
         try:
             response = await self.bot.wait_for(
@@ -1195,8 +1689,7 @@ class WarnSystem(BaseCog):
             await message.edit(content=_("Question timed out."), embed=None)
             return
         if pred.result:
-            async with self.data.custom("MODLOGS", guild.id, member.id).x() as logs:
-                logs[page - 1]["reason"] = new_reason
+            await self.api.edit_case_by_id(guild, case["id"], new_reason)
             await message.clear_reactions()
             await message.edit(content=_("The reason was successfully edited!"), embed=None)
         else:
@@ -1224,9 +1717,12 @@ class WarnSystem(BaseCog):
             )
         await message.clear_reactions()
         embed = message.embeds[0]
-        member = await self.api._get_user_info(
-            int(embed.author.name.rpartition("|")[2].replace(" ", ""))
-        )
+        # the case shown on the page, its position may have changed since it was rendered
+        try:
+            case = await self.api.get_case_by_id(guild, pages.cases[page - 1]["id"])
+        except errors.NotFound:
+            await message.edit(content=_("That case doesn't exist anymore."), embed=None)
+            return
         embed.clear_fields()
         embed.set_footer(text="")
         embed.description = _(
@@ -1242,15 +1738,14 @@ class WarnSystem(BaseCog):
             await message.edit(content=_("Question timed out."), embed=None)
             return
         if pred.result:
-            async with self.data.custom("MODLOGS", guild.id, member.id).x() as logs:
-                logs.remove(logs[page - 1])
+            await self.api.delete_case_by_id(guild, case["id"])
             await message.clear_reactions()
             await message.edit(content=_("The case was successfully deleted!"), embed=None)
         else:
             await message.clear_reactions()
             await message.edit(content=_("The case was not deleted."), embed=None)
 
-    @commands.command(hidden=True)
+    @commands.group(hidden=True, invoke_without_command=True)
     @checks.is_owner()
     async def warnsysteminfo(self, ctx, sentry: str = None):
         """
@@ -1311,10 +1806,71 @@ class WarnSystem(BaseCog):
         ).format(self, status(current_status), ctx.prefix)
         await ctx.send(message)
 
+    @warnsysteminfo.command(name="stats")
+    async def warnsysteminfo_stats(self, ctx):
+        """
+        Show the latency of the API calls and the number of Config reads and writes.
+
+        Latencies are in milliseconds, reads and writes are averages per call.
+        """
+        stats = self.api._get_stats()
+        if not stats["calls"]:
+            await ctx.send(_("No API call was made since the cog was loaded."))
+            return
+        rows = [("call", "count", "p50", "p95", "p99", "max", "reads", "writes")]
+        for name, call in sorted(stats["calls"].items()):
+            rows.append(
+                (
+                    name,
+                    str(call["count"]),
+                    *(f"{call[x] * 1000:.1f}" for x in ("p50", "p95", "p99", "max")),
+                    f"{call['reads'] / call['count']:.1f}",
+                    f"{call['writes'] / call['count']:.1f}",
+                )
+            )
+        widths = [max(len(x[i]) for x in rows) for i in range(len(rows[0]))]
+        text = "\n".join(
+            "  ".join(
+                x.ljust(y) if i == 0 else x.rjust(y) for i, (x, y) in enumerate(zip(row, widths))
+            )
+            for row in rows
+        )
+        expirations = stats["expirations"]
+        cache = stats["user_cache"]
+        text += "\n\n" + _(
+            "Temporary warns: {completed} ended, {failed} failed, {retried} retried, "
+            "{restarts} loop restarts\n"
+            "User cache: {size} users, {hits} hits, {misses} misses, {negative_hits} hits "
+            "on unknown users"
+        ).format(**expirations, **cache)
+        for page in pagify(text, page_length=1900):
+            await ctx.send(f"```\n{page}\n```")
+
     # error handling
     def _set_context(self, data):
         self.sentry.client.extra_context(data)
 
+    async def on_guild_channel_create(self, channel):
+        self.api._invalidate_invite_channel(channel.guild)
+        await self.api._check_mute_overwrite(channel)
+
+    async def on_guild_channel_delete(self, channel):
+        self.api._invalidate_invite_channel(channel.guild)
+
+    async def on_guild_channel_update(self, before, after):
+        if before.position != after.position or before.overwrites != after.overwrites:
+            self.api._invalidate_invite_channel(after.guild)
+        if before.overwrites != after.overwrites:
+            await self.api._check_mute_overwrite(after)
+
+    async def on_guild_role_update(self, before, after):
+        if before.permissions != after.permissions:
+            self.api._invalidate_invite_channel(after.guild)
+
+    async def on_member_update(self, before, after):
+        if after.id == self.bot.user.id and before.roles != after.roles:
+            self.api._invalidate_invite_channel(after.guild)
+
     async def on_command_error(self, ctx, error):
         if not isinstance(error, commands.CommandInvokeError):
             return
@@ -1355,3 +1911,6 @@ class WarnSystem(BaseCog):
 
         # stop checking for unmute and unban
         self.task.cancel()
+        self.mute_task.cancel()
+        self.stats_task.cancel()
+        self.archive_task.cancel()